@@ -0,0 +1,245 @@
+'''
+Benchmark runner: sweeps the protocols over loopback and records the results.
+
+Every case (protocol, congestion control, FEC, window size, MSS, loss rate, file) is repeated once per
+seed. Each run starts server.py and client.py as subprocesses, the server in a
+scratch directory so its output can be checked against the original and thrown
+away. With -sim on, the runs are simulated in this process instead (sim.py), over
+a link with sim.DELAY of one-way delay and in virtual time, which takes a fraction
+of the wall time. The results are written to CSV and JSON for report.py.
+
+Usage:
+    python benchmark.py -r 1,2 -n 4,8,16 -f video.mp4 -loss 0.05,0.1 -fec none,8:1 -seeds 3 -o results [-sim on]
+'''
+import csv
+import filecmp
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import metrics
+import sim
+import udt
+
+
+# Constants
+HERE = os.path.dirname(os.path.abspath(__file__))
+CLIENT_CACHE = os.path.join(HERE, "ClientCache")
+SERVER_STARTUP = 0.5    # Seconds given to the server to bind before the client starts
+RUN_TIMEOUT = 300       # Seconds a single transfer may take before it counts as failed
+SOCKET_BUFFER = 1 << 23 # Bytes of the socket buffers of both programs
+TRANSFER_ID = "benchmark"   # Transfer ID of every run, which names the file the server receives
+
+FIELDS = ["protocol", "cc", "fec", "window_size", "mss", "loss", "file", "seed", "bytes", "ok",
+          "time", "goodput", "transmitted", "retransmissions", "timeouts", "fast_retransmits", "parity"]
+
+
+def free_port():
+    """
+    Finds a UDP port on the loopback interface that nothing is bound to.
+
+    Returns:
+        int: The port number.
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def read_metrics(path):
+    """
+    Extracts the result fields from the metrics the client wrote.
+
+    Parameters:
+        path (str): Path of the client's JSON metrics file.
+
+    Returns:
+        dict: Result fields, empty if the client wrote no metrics.
+    """
+    try:
+        with open(path) as file:
+            summary = json.load(file)
+    except (OSError, ValueError):
+        return {}
+    return result_fields(summary["counters"], summary["gauges"])
+
+
+# Gets the result fields from the counters and gauges of the client's metrics
+def result_fields(counters, gauges):
+    result = {field: counters.get(field, 0) for field in ("transmitted", "retransmissions", "timeouts", "fast_retransmits", "parity")}
+    result["time"] = gauges["time"]
+    return result
+
+
+def run_case(protocol, cc, fec, window_size, mss, loss, file, seed):
+    """
+    Transfers one file and measures it.
+
+    The loss rate applies to both directions, the client's data path seeded with
+    seed and the server's ACK path with seed + 1.
+
+    Parameters:
+        protocol (int): 0 - SnW, 1 - GBN, 2 - SR.
+        cc (str): Congestion control of the client, none or aimd.
+        fec (str): FEC of the client, none or group:parity.
+        window_size (int): Window size of the sender/receiver.
+        mss (int): Maximum segment size in bytes.
+        loss (float): Loss probability of the channel.
+        file (str): Name of the file in ClientCache/ to send.
+        seed (int): Seed of the channel impairments.
+
+    Returns:
+        dict: One result row, see FIELDS.
+    """
+    port = free_port()
+    size = os.path.getsize(os.path.join(CLIENT_CACHE, file))
+    result = {"protocol": protocol, "cc": cc, "fec": fec, "window_size": window_size, "mss": mss, "loss": loss,
+              "file": file, "seed": seed, "bytes": size, "ok": False}
+    channel = ["-loss", str(loss)]
+    # Socket buffers large enough for a full window of the largest segments
+    buffers = ["-sndbuf", str(SOCKET_BUFFER), "-rcvbuf", str(SOCKET_BUFFER)]
+
+    with tempfile.TemporaryDirectory() as scratch:
+        os.mkdir(os.path.join(scratch, "ServerCache"))
+        server = subprocess.Popen([sys.executable, os.path.join(HERE, "server.py"), "-p", str(port),
+                                   "-r", str(protocol), "-n", str(window_size), "-seed", str(seed + 1), "-v", "0"] + channel + buffers,
+                                  cwd = scratch, stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+        try:
+            time.sleep(SERVER_STARTUP)
+            metrics_path = os.path.join(scratch, "metrics.json")
+            subprocess.run([sys.executable, os.path.join(HERE, "client.py"), "-p", str(port),
+                            "-r", str(protocol), "-f", file, "-n", str(window_size), "-mss", str(mss),
+                            "-cc", cc, "-fec", fec, "-id", TRANSFER_ID, "-seed", str(seed), "-v", "0", "-metrics", metrics_path] + channel + buffers,
+                           cwd = HERE, stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL, timeout = RUN_TIMEOUT)
+            result.update(read_metrics(metrics_path))
+        except subprocess.TimeoutExpired:
+            pass
+        finally:
+            # SIGTERM lets the server flush and close its session files
+            server.terminate()
+            server.wait()
+
+        # The received file only gets its final name once verified; its .part, .ranges and .digest files are not compared
+        received = os.path.join(scratch, "ServerCache", f"{TRANSFER_ID}.{file.split('.')[-1].lower()}")
+        if os.path.exists(received):
+            result["ok"] = filecmp.cmp(received, os.path.join(CLIENT_CACHE, file), shallow = False)
+
+    if result.get("time"):
+        result["goodput"] = size / result["time"] / 1e6
+    return result
+
+
+def simulate_case(protocol, cc, fec, window_size, mss, loss, file, seed):
+    """
+    Transfers one file in a simulation and measures it, in virtual time.
+
+    Parameters: as run_case; the loss rate and seed apply to the one channel both directions share.
+
+    Returns:
+        dict: One result row, see FIELDS.
+    """
+    path = os.path.join(CLIENT_CACHE, file)
+    size = os.path.getsize(path)
+    result = {"protocol": protocol, "cc": cc, "fec": fec, "window_size": window_size, "mss": mss, "loss": loss,
+              "file": file, "seed": seed, "bytes": size, "ok": False}
+    fec_group, fec_parity = (0, 0) if fec == "none" else (int(value) for value in fec.split(':'))
+    channel = udt.Channel(loss = loss, delay = sim.DELAY, seed = seed)
+
+    # A run gets as much virtual time as a real one gets wall time
+    with sim.Simulation(protocol, window_size, channel, limit = RUN_TIMEOUT) as simulation:
+        try:
+            stats = simulation.upload(path, mss = mss, congestion_control = cc == "aimd", fec_group = fec_group, fec_parity = fec_parity)
+        except (ValueError, ConnectionError, TimeoutError):
+            return result
+        result.update(result_fields(stats.counters, stats.gauges))
+        result["ok"] = simulation.matches(path)
+
+    if result.get("time"):
+        result["goodput"] = size / result["time"] / 1e6
+    return result
+
+
+def sweep(protocols, controls, codes, window_sizes, mss_values, losses, files, seeds, case = run_case):
+    """
+    Runs every combination of the parameters once per seed.
+
+    Parameters:
+        protocols (list): Protocols to run.
+        controls (list): Congestion controls to run; Stop-and-Wait only runs none.
+        codes (list): FEC settings to run; only Selective Repeat runs more than none.
+        window_sizes (list): Window sizes to run; Stop-and-Wait only runs the first.
+        mss_values (list): Maximum segment sizes to run.
+        losses (list): Loss probabilities to run.
+        files (list): Files in ClientCache/ to send.
+        seeds (int): Number of repetitions of each case.
+        case (function): Runs one case, run_case or simulate_case.
+
+    Returns:
+        list: One result row per run.
+    """
+    results = []
+    for file in files:
+        for protocol in protocols:
+            for cc in (["none"] if protocol == 0 else controls):
+                for fec in (codes if protocol == 2 else ["none"]):
+                    for window_size in (window_sizes[:1] if protocol == 0 else window_sizes):
+                        for mss in mss_values:
+                            for loss in losses:
+                                for seed in range(seeds):
+                                    result = case(protocol, cc, fec, window_size, mss, loss, file, seed)
+                                    print(f"r={protocol} cc={cc} fec={fec} n={window_size} mss={mss} loss={loss} file={file} seed={seed}: "
+                                          f"{'ok' if result['ok'] else 'FAILED'} time={result.get('time')} "
+                                          f"retransmissions={result.get('retransmissions')}")
+                                    results.append(result)
+    return results
+
+
+def write_results(results, prefix):
+    """
+    Writes the result rows to prefix.csv and prefix.json.
+
+    Parameters:
+        results (list): Result rows.
+        prefix (str): Path of the output files without extension.
+    """
+    with open(prefix + ".csv", "w", newline = "") as file:
+        writer = csv.DictWriter(file, fieldnames = FIELDS)
+        writer.writeheader()
+        for result in results:
+            writer.writerow({field: result.get(field, "") for field in FIELDS})
+    with open(prefix + ".json", "w") as file:
+        json.dump(results, file, indent = 2)
+
+
+if __name__ == "__main__":
+    # Parse command-line arguments, every option takes a comma-separated list
+    args = {}
+    for flag, value in zip(sys.argv[1::2], sys.argv[2::2]):
+        args[flag] = value
+
+    if '-f' not in args:
+        print('Usage : "python benchmark.py -f files [-r protocols] [-cc controls] [-fec codes] [-n window_sizes] [-mss sizes] [-loss rates] [-seeds count] [-o prefix] [-sim on|off]"\n[files: files in ClientCache/ to send]\n[protocols: 0 - SnW, 1 - GBN, 2 - SR; default 1]\n[controls: congestion controls, none or aimd; default none]\n[codes: FEC of SR, none or group:parity; default none]\n[window_sizes: default 4,8,16]\n[sizes: maximum segment sizes, default 1000]\n[rates: loss probabilities, default 0.05]\n[count: repetitions of each case with different seeds, default 3]\n[prefix: output path without extension, default results]\n[-sim: simulate the runs in virtual time instead of over loopback, default off]')
+        sys.exit(2)
+
+    protocols = [int(value) for value in args.get('-r', "1").split(',')]
+    controls = args.get('-cc', "none").split(',')
+    codes = args.get('-fec', "none").split(',')
+    window_sizes = [int(value) for value in args.get('-n', "4,8,16").split(',')]
+    mss_values = [int(value) for value in args.get('-mss', "1000").split(',')]
+    losses = [float(value) for value in args.get('-loss', "0.05").split(',')]
+    files = args['-f'].split(',')
+    seeds = int(args.get('-seeds', 3))
+    prefix = args.get('-o', "results")
+    simulated = args.get('-sim', "off") == "on"
+
+    if simulated:
+        metrics.LEVEL = metrics.QUIET
+    results = sweep(protocols, controls, codes, window_sizes, mss_values, losses, files, seeds, simulate_case if simulated else run_case)
+    write_results(results, prefix)
+    failed = sum(1 for result in results if not result["ok"])
+    print(f"{len(results)} runs, {failed} failed; results written to {prefix}.csv and {prefix}.json")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,214 @@
+# chunks.py - Content-defined chunking and a content-addressed chunk index
+#
+# Chunks end where a gear rolling hash of the bytes before matches a mask, so the
+# boundaries depend on the content rather than on offsets: an insertion only changes
+# the chunks around it, and the rest of a slightly changed file still deduplicates.
+# With NumPy, the hash is computed at every byte of a block at once.
+import bisect
+import collections
+import hashlib
+import json
+import os
+import random
+import struct
+import sys
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MIN_CHUNK = 1 << 11     # Bytes
+AVERAGE_CHUNK = 1 << 13 # Expected bytes after MIN_CHUNK before a boundary
+MAX_CHUNK = 1 << 16     # Bytes
+BLOCK = 1 << 20         # Bytes read at a time while chunking a file
+
+# The gear hash shifts left once per byte, so its top bits cover the last 64 bytes
+_GEAR = [random.Random(0x67656172 + byte).getrandbits(64) for byte in range(256)]
+_MASK = (AVERAGE_CHUNK - 1) << (64 - AVERAGE_CHUNK.bit_length() + 1)
+_WINDOW = 64
+_PIECE = 1 << 16        # Bytes hashed at once with NumPy
+_GEAR_ARRAY = numpy.array(_GEAR, dtype = numpy.uint64) if numpy is not None else None
+
+# Manifest entry: offset, length and SHA-256 digest of a chunk
+ENTRY = struct.Struct("!QI32s")
+
+
+def _candidates(data):
+    """
+    Finds every offset of data a chunk may end at, with NumPy: the offsets after the bytes
+    where the gear hash of the _WINDOW bytes up to them matches the mask.
+
+    The hash at a byte sums the gear values of the _WINDOW bytes up to it, each shifted
+    left by its distance, so it is the same whichever byte the hashing started from.
+
+    Parameters:
+        data (bytes): Buffered file data, starting at a chunk.
+
+    Returns:
+        list: Increasing offsets, from _WINDOW on.
+    """
+    data = numpy.frombuffer(data, dtype = numpy.uint8)
+    found = []
+    # A piece at a time, each with the _WINDOW - 1 bytes before it, so the arrays stay in cache
+    for piece in range(0, len(data), _PIECE):
+        low = max(0, piece - _WINDOW + 1)
+        hashes = _GEAR_ARRAY[data[low:piece + _PIECE]]
+        # Each step doubles the bytes summed at every position, wrapping around at 64 bits
+        shift = 1
+        while shift < _WINDOW:
+            hashes[shift:] += hashes[:-shift] << numpy.uint64(shift)
+            shift *= 2
+        ends = numpy.flatnonzero((hashes & numpy.uint64(_MASK)) == 0) + (low + 1)
+        found.append(ends[ends >= max(_WINDOW, piece + 1)])
+    return numpy.concatenate(found).tolist() if found else []
+
+
+def _cut(data, start, final, candidates = None):
+    """
+    Finds the end of the chunk starting at start.
+
+    Parameters:
+        data (bytes): Buffered file data.
+        start (int): Offset of the chunk in data.
+        final (bool): Whether data reaches the end of the file.
+        candidates (list): Offsets of data a chunk may end at (_candidates), None to hash the chunk here.
+
+    Returns:
+        int: Offset after the chunk in data, None if more data is needed to decide.
+    """
+    end = min(len(data), start + MAX_CHUNK)
+    if candidates is not None:
+        i = bisect.bisect_left(candidates, start + MIN_CHUNK)
+        if i < len(candidates) and candidates[i] <= end:
+            return candidates[i]
+    else:
+        gear = _GEAR
+        h = 0
+        # Bytes before the last _WINDOW ones of MIN_CHUNK never reach the top bits of the hash at a candidate boundary
+        first = start + MIN_CHUNK - 1   # The first byte a chunk may end with
+        for byte in data[start + max(0, MIN_CHUNK - _WINDOW):first]:
+            h = ((h << 1) + gear[byte]) & 0xFFFFFFFFFFFFFFFF
+        for i, byte in enumerate(data[first:end], first + 1):
+            h = ((h << 1) + gear[byte]) & 0xFFFFFFFFFFFFFFFF
+            if not h & _MASK:
+                return i
+    if end == start + MAX_CHUNK or final:
+        return end
+    return None
+
+
+def chunk_file(file_path):
+    """
+    Splits a file into content-defined chunks, reading it BLOCK bytes at a time.
+
+    Parameters:
+        file_path (str): Path of the file.
+
+    Returns:
+        list: (offset, length, SHA-256 digest) of each chunk, in file order.
+    """
+    chunks = []
+    offset = 0      # File offset of data[0]
+    data = b''
+    with open(file_path, "rb") as file:
+        while True:
+            block = file.read(BLOCK)
+            data += block
+            final = not block
+            candidates = _candidates(data) if numpy is not None else None
+            start = 0
+            while start < len(data):
+                end = _cut(data, start, final, candidates)
+                if end is None:
+                    break
+                chunks.append((offset + start, end - start, hashlib.sha256(data[start:end]).digest()))
+                start = end
+            offset += start
+            data = data[start:]
+            if final:
+                return chunks
+
+
+class Index(object):
+    """
+    Where the server holds the bytes of each chunk it received, keyed by digest.
+
+    Bounded to capacity entries, evicting the least recently used, and saved as a
+    JSON list in LRU order. Chunks are read back and checked against their digest,
+    so entries of files changed or removed since merely miss.
+
+    Attributes:
+        path (str): Path of the JSON file.
+        directory (str): Directory of the files the entries point into.
+        capacity (int): Maximum number of entries.
+        entries (collections.OrderedDict): (file name, offset, length) by hex digest, least recently used first.
+        dirty (bool): Whether entries changed since the last save.
+    """
+
+    def __init__(self, path, directory, capacity):
+        self.path = path
+        self.directory = directory
+        self.capacity = capacity
+        self.entries = collections.OrderedDict()
+        self.dirty = False
+        try:
+            with open(path) as file:
+                for digest, name, offset, length in json.load(file)[-capacity:]:
+                    self.entries[digest] = (name, offset, length)
+        except (OSError, ValueError):
+            pass
+
+    # Gets the bytes of a chunk, None if not held
+    def read(self, digest):
+        key = digest.hex()
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        self.entries.move_to_end(key)
+        self.dirty = True
+        name, offset, length = entry
+        try:
+            with open(os.path.join(self.directory, name), "rb") as file:
+                file.seek(offset)
+                data = file.read(length)
+        except OSError:
+            return None
+        return data if hashlib.sha256(data).digest() == digest else None
+
+    # Records where a chunk will be held; the older location wins while it is still indexed
+    def add(self, digest, name, offset, length):
+        key = digest.hex()
+        if key in self.entries:
+            self.entries.move_to_end(key)
+        else:
+            self.entries[key] = (name, offset, length)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last = False)
+        self.dirty = True
+
+    # Writes the entries, atomically
+    def save(self):
+        with open(self.path + ".tmp", "w") as file:
+            json.dump([[digest, name, offset, length] for digest, (name, offset, length) in self.entries.items()], file)
+        os.replace(self.path + ".tmp", self.path)
+        self.dirty = False
+
+
+if __name__ == "__main__":
+    # Throughput: python chunks.py [file]
+    # The same chunks hashed byte by byte and, with NumPy, at every byte of a block at once
+    path = sys.argv[1] if len(sys.argv) > 1 else os.path.join("ClientCache", "video.mp4")
+    size = os.path.getsize(path)
+    vectorized = numpy
+    results = {}
+    for name, module in (("numpy", vectorized), ("python", None)):
+        if name == "numpy" and vectorized is None:
+            continue
+        numpy = module
+        start = time.perf_counter()
+        results[name] = chunk_file(path)
+        print(f"{os.path.basename(path)} ({name}): {len(results[name])} chunks, {size / (time.perf_counter() - start) / 1e6:.1f} MB/s")
+    numpy = vectorized
+    assert all(chunked == results["python"] for chunked in results.values())
@@ -7,259 +7,1024 @@ Send data along w/ sequence # (0, 1); Start Timer()
         - stopTimer()
     - Retransmit data w/ sequence # (0, 1)
 - else: timeout() -> Retransmit data w/ sequence # (0, 1)
-Note: We will keep doing this until file fully sends as MSS is 1000 bytes.
+Note: We will keep doing this until file fully sends, MSS bytes at a time (negotiated with the server).
 '''
-import socket
+import collections
+import concurrent.futures
+import hashlib
+import heapq
+import itertools
 import sys
+import threading
 import udt, packet
-import timer as t, time
+import timer as t
+import rto
+import congestion
+import integrity
+import segments
+import metrics
+import ranges
+import fec
+import compress
+import chunks
+import digest
+import seqnum
 import os
 
 
 # Constants
 HOST = "127.0.0.1"
 CACHE = "ClientCache/"
-MSS = 1000
+MSS = 1000      # Proposed maximum segment size, None for the largest the path MTU allows
+RTO_MIN = 0.2   # Default lower bound of the retransmission timeout (seconds)
+RTO_MAX = 60    # Default upper bound of the retransmission timeout (seconds)
+HANDSHAKE_ATTEMPTS = 10 # Control packets (initialization, manifest, end of transfer) sent before giving up on the server
+HANDSHAKE_TIMEOUT = 1   # Seconds to wait for the server's first answer, until its RTT is measured
+SACK_THRESHOLD = 3      # Packets selectively acknowledged beyond a hole before it counts as lost
 
+# Outgoing packets are packed into these preallocated buffers, one per packet of a burst,
+# so sending allocates nothing per packet; each flow's thread has its own pool
+SEND_BUFFERS = threading.local()
 
-def create_checksum(i, data):
+
+class Connection:
+    """
+    One upload of a file to a server: what to send, how, and what was negotiated.
+
+    Holds everything the senders need, so that any number of uploads can run in
+    one process, each with its own settings.
+
+    Attributes:
+        server_address (tuple): The server's (host, port) tuple.
+        protocol (int): Key of the sender in SENDERS (0 - SnW, 1 - GBN, 2 - SR).
+        window_size (int): Largest number of packets in flight.
+        file_path (str): Path of the file to upload.
+        extension (str): Extension of the file, lowercase.
+        file_size (int): Size of the file in bytes.
+        transfer_id (str): Identifier of the transfer, which resumes it on the server.
+        mss (int): Proposed maximum segment size, None for the largest the path MTU allows; the granted one once connected.
+        mtu (int): Path MTU, None to probe it.
+        rto_min (float): Lower bound of the retransmission timeout (seconds).
+        rto_max (float): Upper bound of the retransmission timeout (seconds).
+        congestion_control (bool): Whether GBN and SR use AIMD congestion control.
+        flows (int): Parallel flows sending ranges of the file.
+        codec (str): none, auto or a codec of compress.available(); the one chosen once connected.
+        level (int): Compression level, the codec's default if None.
+        dedup (bool): Whether the server fills in the chunks it already holds first.
+        fec_group (int): Data segments per FEC group, 0 without FEC.
+        fec_parity (int): Parity segments per FEC group.
+        sndbuf (int): Socket send buffer size, the system default if None.
+        rcvbuf (int): Socket receive buffer size, the system default if None.
+        trace (bool): Whether the flows record an event trace.
+        control (rto.RTOEstimator): Retransmission timeout of the control packets, sampled on the server's answers.
+    """
+
+    def __init__(self, file_path, port, protocol, window_size, host = HOST, mss = MSS, mtu = None, rto_min = RTO_MIN, rto_max = RTO_MAX,
+                 congestion_control = False, flows = 1, codec = "none", level = None, dedup = False, fec_group = 0, fec_parity = 0,
+                 transfer_id = None, sndbuf = None, rcvbuf = None, trace = False):
+        """
+        Initializes a Connection object, checking the settings.
+
+        The same file (name, size and modification time) always gets the same transfer ID,
+        so that an interrupted transfer resumes where it stopped.
+
+        Parameters:
+            file_path (str): Path of the file to upload.
+            port (int): The server's port.
+            protocol (int): Key of the sender in SENDERS.
+            window_size (int): Largest number of packets in flight.
+            transfer_id (str): Identifier of the transfer, derived from the file if None.
+            The others: as the attributes.
+
+        Raises:
+            ValueError: If a setting is invalid.
+            OSError: If the file cannot be read.
+        """
+        if protocol not in SENDERS:
+            raise ValueError(f"The protocol must be one of {', '.join(str(key) for key in SENDERS)}.")
+        if not 0 < window_size < seqnum.HALF:
+            raise ValueError(f"The window size must be between 1 and {seqnum.HALF - 1} packets.")
+        if protocol == 2 and sack_size(window_size) > udt.MAX_DATAGRAM:
+            raise ValueError(f"Selective Repeat's acknowledgements must fit in a datagram, so at most {(udt.MAX_DATAGRAM - packet.HEADER_SIZE) * 8 - 1} packets of window.")
+        if codec not in ["none", "auto"] + compress.available():
+            raise ValueError(f"Compression must be none, auto or one of {', '.join(compress.available())}.")
+        if fec_group and (protocol != 2 or not 0 < fec_parity <= fec_group):
+            raise ValueError("FEC needs Selective Repeat and group:parity with 0 < parity <= group.")
+
+        self.server_address = (host, port)
+        self.protocol = protocol
+        self.window_size = window_size
+        self.file_path = file_path
+        name = os.path.basename(file_path)
+        self.extension = name.split('.')[-1].lower()
+        self.file_size = os.path.getsize(file_path)
+        self.transfer_id = transfer_id or hashlib.sha1(f"{name}:{self.file_size}:{os.stat(file_path).st_mtime_ns}".encode()).hexdigest()[:16]
+        if not self.transfer_id.isalnum():
+            raise ValueError("The transfer ID must be alphanumeric.")
+        self.mss = mss
+        self.mtu = mtu
+        self.rto_min = rto_min
+        self.rto_max = rto_max
+        self.congestion_control = congestion_control
+        self.flows = flows
+        self.codec = codec
+        self.level = level
+        self.dedup = dedup
+        self.fec_group = fec_group
+        self.fec_parity = fec_parity
+        self.sndbuf = sndbuf
+        self.rcvbuf = rcvbuf
+        self.trace = trace
+        self.control = rto.RTOEstimator(initial_rto = HANDSHAKE_TIMEOUT, min_rto = rto_min, max_rto = rto_max)
+
+
+def send_segments(conn, sock, burst, stats):
+    """
+    Packs a burst of segments into the send buffers and sends them in one batch.
+
+    Parameters:
+        conn (Connection): The upload the segments belong to.
+        sock (socket.socket): The UDP socket to send the packets on.
+        burst (list): (sequence number, payload) pairs; a str payload is the initialization string.
+        stats (metrics.Metrics): Metrics of the transfer, traced when enabled.
+    """
+    buffers = getattr(SEND_BUFFERS, "pool", None)
+    if buffers is None or (buffers and len(buffers[0]) < packet.HEADER_SIZE + conn.mss):
+        buffers = SEND_BUFFERS.pool = []
+    while len(buffers) < len(burst):
+        buffers.append(bytearray(packet.HEADER_SIZE + conn.mss))
+
+    packets = []
+    for buffer, (seq_num, payload) in zip(buffers, burst):
+        if isinstance(payload, str):
+            length = packet.make_into(buffer, seq_num, bytes(payload, "utf-8"), packet.SYN)
+        else:
+            length = packet.make_into(buffer, seq_num, payload)
+        packets.append(memoryview(buffer)[:length])
+        if stats.trace is not None:
+            stats.trace.record("send", seq_num, None, length)
+    udt.send_batch(packets, sock, conn.server_address)
+
+
+# Gets the size of the largest acknowledgement of a window: the bitmap only holds packets the sender has in flight
+def sack_size(window_size):
+    return packet.HEADER_SIZE + window_size // 8 + 1
+
+
+class AckQueue:
+    """
+    Acknowledgements drained from the socket in batches and handed out one at a time.
+
+    Sequence numbers are unwrapped from the wire around the oldest unacknowledged
+    packet, which the sender passes to get.
+
+    Attributes:
+        space (int): Sequence space of the acknowledgements, seqnum.SPACE or seqnum.ALTERNATING.
+        pending (collections.deque): (acknowledged sequence number, SACK) pairs not handed out yet.
+        window (int): Receive window advertised by the latest acknowledgement, None before the first.
+        sack (tuple): The receiver's next expected sequence number and the sequence numbers it holds
+            beyond it, as selectively acknowledged by the acknowledgement handed out last; None without SACK.
+    """
+
+    def __init__(self, sock, stats, space = seqnum.SPACE, window_size = 0):
+        """
+        Initializes an AckQueue object.
+
+        Parameters:
+            sock (socket.socket): The UDP socket the acknowledgements arrive on.
+            stats (metrics.Metrics): Metrics of the transfer, traced when enabled.
+            space (int): Sequence space of the acknowledgements.
+            window_size (int): The sender's window, which bounds the SACK bitmaps received.
+        """
+        self.space = space
+        self.receiver = udt.BatchReceiver(sock, size = max(udt.BUFFER_SIZE, sack_size(window_size)))
+        self.pending = collections.deque()
+        self.window = None
+        self.sack = None
+        self.stats = stats
+
+    def get(self, timeout, base):
+        """
+        Gets the next valid acknowledgement, waiting for a batch if none is pending.
+
+        Parameters:
+            timeout (float): Seconds to wait at most.
+            base (int): The sender's oldest unacknowledged sequence number.
+
+        Returns:
+            int: The acknowledged sequence number, or None if nothing valid arrived.
+        """
+        if not self.pending:
+            for rcvpkt, _ in self.receiver.recv(timeout):
+                if packet.verify(rcvpkt):
+                    seq, ack, flags, window, data = packet.extract(rcvpkt)
+                    if flags & packet.ACK:
+                        seq = seqnum.unwrap(seq, base, self.space)
+                        ack = seqnum.unwrap(ack, base, self.space)
+                        self.window = window
+                        if metrics.LEVEL >= metrics.PACKETS:
+                            print("Client: Ack Received - ", ack)
+                        if self.stats.trace is not None:
+                            self.stats.trace.record("ack", None, ack)
+                        sack = (seq, packet.extract_sack(seq, data)) if flags & packet.SACK else None
+                        self.pending.append((ack, sack))
+        if not self.pending:
+            return None
+        ack, self.sack = self.pending.popleft()
+        return ack
+
+
+def request(conn, sock, receiver, pkt, answer):
+    """
+    Sends a control packet until the server answers it, at most HANDSHAKE_ATTEMPTS times.
+
+    The wait for each answer is the connection's control RTO: answers to a packet
+    sent once sample the RTT, and every unanswered send backs the timeout off.
+
+    Parameters:
+        conn (Connection): The upload.
+        sock (socket.socket): The UDP socket to send the packet on.
+        receiver (udt.BatchReceiver): Receives the answers arriving on sock.
+        pkt (bytes): The control packet.
+        answer (function): Gets the answer from the ACK number, flags and payload of a valid packet,
+            None if the packet does not answer this one.
+
+    Returns:
+        The answer, or None if the server never answered.
     """
-    Creates a checksum for the given data.
+    estimator = conn.control
+    mytimer = t.Timer(estimator.rto)
+    for attempt in range(HANDSHAKE_ATTEMPTS):
+        udt.send(pkt, sock, conn.server_address)
+        sent_at = t.now()
+        mytimer.start()
+        while not mytimer.timeout():
+            for rcvpkt, _ in receiver.recv(mytimer.time_left()):
+                if packet.verify(rcvpkt):
+                    _, ack, flags, _, data = packet.extract(rcvpkt)
+                    result = answer(ack, flags, data)
+                    if result is not None:
+                        # Karn's rule: an answer after a resend may answer either send
+                        if attempt == 0:
+                            estimator.sample(t.now() - sent_at)
+                        estimator.acked()
+                        return result
+        mytimer.stop()
+        estimator.backoff()
+    return None
+
+
+def initialization(conn, mss, offset, length, codec = "none", encoded = None):
+    """
+    Builds the initialization string carried by the SYN.
 
     Parameters:
-        i (int): Sequence number.
-        data (bytes): Data for which checksum is to be created.
+        conn (Connection): The upload.
+        mss (int): Proposed maximum segment size.
+        offset (int): First byte of the range the flow sends.
+        length (int): Bytes in the range, 0 to only ask for the missing ranges.
+        codec (str): Codec the range is compressed with, none for raw data.
+        encoded (int): Bytes of the range as sent, length by default.
 
     Returns:
-        str: Computed checksum.
+        str: File extension, number of packets the server should expect, MSS, transfer ID,
+        file size, the range, the FEC group and parity segment counts and the codec and
+        size of the range as sent, separated by colons.
     """
+    encoded = length if encoded is None else encoded
+    max_packets_transmitted = 2 if conn.protocol == 0 else (encoded + mss - 1) // mss + 1
+    return (f"{conn.extension}:{max_packets_transmitted}:{mss}:{conn.transfer_id}:{conn.file_size}:{offset}:{length}"
+            f":{conn.fec_group}:{conn.fec_parity}:{codec}:{encoded}")
 
-    # Add sequence number
-    data = bytes([i]) + data
 
-    # Get sum of bits
-    data_sum = len(data)
-    bit_sum = bin(data_sum)[2:]
-    
-    # Pad to 10 bits
-    while len(bit_sum) < 10: 
-        bit_sum = '0' + bit_sum
+def handshake(conn, sock, mss, offset, length, codec = "none", encoded = None):
+    """
+    Negotiates the MSS with the server and learns which ranges of the file it is missing
+    and which codecs it can decompress. The server lists a limited number of missing
+    ranges but counts every missing byte.
+
+    Sends the initialization until the server answers with the MSS it grants.
+    If it grants a smaller one, proposes that one instead so that the packet
+    count of the initialization matches the segmentation.
+
+    Parameters:
+        conn (Connection): The upload.
+        sock (socket.socket): The UDP socket to send packets on.
+        mss (int): Proposed maximum segment size.
+        offset (int): First byte of the range the flow sends.
+        length (int): Bytes in the range, 0 to only ask for the missing ranges.
+        codec (str): Codec the range is compressed with, none for raw data.
+        encoded (int): Bytes of the range as sent, length by default.
+
+    Returns:
+        tuple: The negotiated MSS, the missing ranges (the first of them), the server's codecs and
+        the bytes missing in all, or None if the server never answered.
+    """
+    receiver = udt.BatchReceiver(sock)
+    for _ in range(HANDSHAKE_ATTEMPTS):
+        pkt = packet.make(0, bytes(initialization(conn, mss, offset, length, codec, encoded), "utf-8"), packet.SYN)
+        answer = request(conn, sock, receiver, pkt,
+                         lambda ack, flags, data: str(data, "utf-8").split(":") if flags & packet.SYN and flags & packet.ACK else None)
+        if answer is None:
+            return None
+        granted, missing, codecs = int(answer[0]), ranges.decode(answer[1]), answer[2].split(",")
+        missing_bytes = int(answer[3]) if len(answer) > 3 else sum(end - start for start, end in missing)
+        if granted >= mss:
+            return mss, missing, codecs, missing_bytes
+        mss = granted
+    return None
+
+
+def query(conn, mss):
+    """
+    Asks the server which ranges of the file it is still missing.
+
+    Parameters:
+        conn (Connection): The upload.
+        mss (int): Proposed maximum segment size.
+
+    Returns:
+        tuple: As handshake, or None if the server never answered.
+    """
+    sock = udt.open_socket()
+    try:
+        return handshake(conn, sock, mss, 0, 0)
+    finally:
+        sock.close()
+
+
+def deduplicate(conn, missing):
+    """
+    Sends the manifest of the chunks in the missing ranges, so that the server
+    fills in the chunks it already holds from other uploads.
+
+    Up to window_size manifest packets are outstanding at once, each acknowledged on
+    its own. The packets outstanding are resent whenever the control RTO runs out
+    without an answer, backing it off, at most HANDSHAKE_ATTEMPTS times in a row.
+
+    Parameters:
+        conn (Connection): The upload, connected.
+        missing (list): Missing ranges [start, end) of the file.
+
+    Returns:
+        int: Bytes of the chunks the server holds, None if it stopped answering.
+    """
+    manifest = [chunks.ENTRY.pack(offset, length, digest) for offset, length, digest in chunks.chunk_file(conn.file_path)
+                if ranges.covers(missing, offset, offset + length)]
+    header = bytes(f"{conn.extension}:{conn.transfer_id}:{conn.file_size}\n", "utf-8")
+    per_packet = max(1, (conn.mss - len(header)) // chunks.ENTRY.size)
+    pkts = [packet.make(seq, header + b"".join(manifest[first:first + per_packet]), packet.DEDUP)
+            for seq, first in enumerate(range(0, len(manifest), per_packet))]
+
+    estimator = conn.control
+    mytimer = t.Timer(estimator.rto)
+    outstanding = {}    # Send times of the packets not acknowledged yet, keyed by sequence number
+    resent = set()      # Packets sent more than once, whose answers do not sample the RTT
+    next_seq = 0
+    timeouts = 0        # Timeouts since the last answer
+    copied = 0
+    sock = udt.open_socket()
+    receiver = udt.BatchReceiver(sock)
+    try:
+        while next_seq < len(pkts) or outstanding:
+            burst = []
+            while next_seq < len(pkts) and len(outstanding) < conn.window_size:
+                outstanding[next_seq] = t.now()
+                burst.append(pkts[next_seq])
+                next_seq += 1
+            if burst:
+                udt.send_batch(burst, sock, conn.server_address)
+                mytimer.start()
+
+            if mytimer.timeout():
+                timeouts += 1
+                if timeouts == HANDSHAKE_ATTEMPTS:
+                    return None
+                estimator.backoff()
+                resent.update(outstanding)
+                udt.send_batch([pkts[seq] for seq in outstanding], sock, conn.server_address)
+                mytimer.stop()
+                mytimer.start()
+                continue
+
+            for rcvpkt, _ in receiver.recv(mytimer.time_left()):
+                if packet.verify(rcvpkt):
+                    _, ack, flags, _, data = packet.extract(rcvpkt)
+                    if flags & packet.DEDUP and flags & packet.ACK and ack in outstanding:
+                        sent_at = outstanding.pop(ack)
+                        # Karn's rule: an answer after a resend may answer either send
+                        if ack not in resent:
+                            estimator.sample(t.now() - sent_at)
+                        estimator.acked()
+                        copied += int(str(data, "utf-8"))
+                        timeouts = 0
+                        mytimer.stop()
+            if outstanding:
+                mytimer.start()
+    finally:
+        sock.close()
+    return copied
+
+
+def finish(conn, file_digest):
+    """
+    Ends the transfer: sends the file's digest in a FIN until the server answers with a FIN-ACK,
+    once it has checked its copy of the file against the digest.
+
+    Parameters:
+        conn (Connection): The upload, with every range sent.
+        file_digest (str): Hexadecimal digest of the file (digest.of_file).
+
+    Returns:
+        str: The server's verdict (digest.OK, digest.MISMATCH or digest.MISSING), None if it never answered.
+    """
+    pkt = packet.make(0, bytes(f"{conn.extension}:{conn.transfer_id}:{conn.file_size}:{file_digest}", "utf-8"), packet.FIN)
+    sock = udt.open_socket()
+    try:
+        return request(conn, sock, udt.BatchReceiver(sock), pkt,
+                       lambda ack, flags, data: str(data, "utf-8") if flags & packet.FIN and flags & packet.ACK else None)
+    finally:
+        sock.close()
 
-    # Get Ones' Complement (Flip all the bits)
-    checksum = ''
-    for bit in bit_sum:
-        checksum += '1' if bit == '0' else '0'
 
-    return checksum
+def send_range(conn, byte_range):
+    """
+    Sends one range of the file as one flow, over its own socket, compressed
+    first into a temporary file when a codec was chosen.
 
+    Parameters:
+        conn (Connection): The upload, connected.
+        byte_range (list): The [start, end) byte range of the file to send.
 
-def verify_checksum(i, checksum, data):
+    Returns:
+        metrics.Metrics: Metrics of the flow.
     """
-    Verifies the checksum of the received data.
+    offset, length = byte_range[0], byte_range[1] - byte_range[0]
+    stats = metrics.Metrics(trace = conn.trace)
+    sock = udt.open_socket()
+    udt.set_buffers(sock, conn.sndbuf, conn.rcvbuf)
+    path, start, encoded = conn.file_path, offset, length
+    if conn.codec != "none":
+        path, start = compress.compress_range(conn.file_path, offset, length, conn.codec, conn.level), 0
+        encoded = os.path.getsize(path)
+    stats.counters["encoded_bytes"] += encoded
+    try:
+        answer = handshake(conn, sock, conn.mss, offset, length, conn.codec, encoded)
+        if answer is None or answer[0] != conn.mss:
+            stats.counters["failed_flows"] += 1
+            return stats
+
+        # Separate the range into packets of size 'MSS', read lazily as the window advances
+        header = initialization(conn, conn.mss, offset, length, conn.codec, encoded)
+        with segments.SegmentSource(path, conn.mss, header, start, encoded) as data_packets:
+            SENDERS[conn.protocol](conn, sock, data_packets, stats)
+    finally:
+        sock.close()
+        if path != conn.file_path:
+            os.remove(path)
+    return stats
+
+
+def current_window(conn, cc, acks):
+    """
+    Gets the number of packets a windowed sender may have in flight.
 
     Parameters:
-        i (int): Sequence number.
-        checksum (str): Received checksum.
-        data (bytes): Received data.
+        conn (Connection): The upload.
+        cc (congestion.AIMD): Congestion controller, None to use the fixed window.
+        acks (AckQueue): Acknowledgements, carrying the receiver's advertised window.
 
     Returns:
-        bool: True if the checksum is valid, False otherwise.
+        int: The smallest of window_size, the congestion window and the advertised window,
+        and at least 1 so that a closed receive window is still probed.
+    """
+    window = conn.window_size if cc is None else min(conn.window_size, cc.window())
+    if acks.window is not None:
+        window = min(window, acks.window)
+    return max(1, window)
+
+
+class Flow:
+    """
+    What the senders share around their windowing strategy: the acknowledgements, the
+    retransmission timeout, the congestion controller and the counts of one flow, and the
+    teardown that sends the "DONE" signal and records the summary.
+
+    A sender runs its strategy in "with Flow(...) as flow:", so that the teardown runs
+    however the strategy ends.
+
+    Attributes:
+        conn (Connection): The upload the flow belongs to.
+        sock (socket.socket): The UDP socket the flow sends on.
+        data_packets (segments.SegmentSource): Segments to send, released once ACK'ed.
+        stats (metrics.Metrics): Metrics the flow is recorded in.
+        acks (AckQueue): Acknowledgements of the flow.
+        estimator (rto.RTOEstimator): Retransmission timeout.
+        cc (congestion.AIMD): Congestion controller, None without congestion control.
+        send_times (dict): First transmission time of each packet, None once retransmitted.
+        transmitted (int): Packets transmitted, retransmissions included.
+        timeouts (int): Retransmission timeouts.
+        fast_retransmits (int): Packets retransmitted before their timeout.
+        end (int): Sequence number of the "DONE" signal, the first packet not sent.
     """
-    received_checksum = create_checksum(i, data).encode("utf-8")
 
-    return checksum == received_checksum
+    def __init__(self, conn, sock, data_packets, stats, space = seqnum.SPACE, windowed = True):
+        """
+        Initializes a Flow object.
+
+        Parameters:
+            conn, sock, data_packets, stats: As the attributes.
+            space (int): Sequence space of the flow's packets on the wire.
+            windowed (bool): Whether the strategy keeps a window the congestion controller may limit.
+        """
+        self.conn = conn
+        self.sock = sock
+        self.data_packets = data_packets
+        self.stats = stats
+        self.acks = AckQueue(sock, stats, space, conn.window_size)
+        # The data starts out with the timeout the handshake measured
+        self.estimator = rto.RTOEstimator(initial_rto = conn.control.rto(), min_rto = conn.rto_min, max_rto = conn.rto_max)
+        self.cc = congestion.AIMD(conn.window_size) if windowed and conn.congestion_control else None
+        self.send_times = {}
+        self.transmitted = 0
+        self.timeouts = 0
+        self.fast_retransmits = 0
+        self.end = 0
+        self.start_time = None
 
+    def __enter__(self):
+        self.start_time = t.now()
+        return self
 
-def print_summary(total_transmitted_packets, retransmissions, transmission_time):
-    # i. Total number of transmitted packets.
-    print("Total number of transmitted packets: ", total_transmitted_packets)
-    # ii. Number of retransmitted packets:
-    print("Number of retransmitted packets: ", retransmissions)
-    # iii. Time taken to complete file transfer.
-    print("Time taken to complete file transfer: ", transmission_time)
+    # Samples the RTT of an acknowledged packet first sent at sent_at, None if it was retransmitted
+    def acked(self, sent_at):
+        if sent_at is not None:
+            rtt = t.now() - sent_at
+            self.estimator.sample(rtt)
+            self.stats.rtt.record(rtt)
+        self.estimator.acked()
 
+    # Finished sending all the packets, or stopped: send "DONE" signal and record the summary
+    def __exit__(self, *_):
+        pkt = packet.make(self.end, flags = packet.FIN)
+        udt.send(pkt, self.sock, self.conn.server_address)
+        if metrics.LEVEL >= metrics.SUMMARY:
+            print("I am DONE sending")
 
-def snw_sender(sock, server_address, data_packets):
+        stats = self.stats
+        stats.counters.update(transmitted = self.transmitted, retransmissions = self.transmitted - len(self.data_packets),
+                              timeouts = self.timeouts, fast_retransmits = self.fast_retransmits)
+        stats.gauges["time"] = t.now() - self.start_time
+        stats.gauges.update(self.estimator.summary())
+        if self.cc is not None:
+            stats.gauges.update(self.cc.summary())
+        return False
+
+
+def snw_sender(conn, sock, data_packets, stats):
     """
     Sends packets using Stop-and-Wait protocol.
 
     Parameters:
+    - conn (Connection): The upload the flow belongs to.
     - sock (socket.socket): The UDP socket to send packets on.
-    - server_address (tuple): The server's (host, port) tuple.
-    - data_packets (list): List of data packets to send.
+    - data_packets (segments.SegmentSource): Segments to send, released once ACK'ed.
+    - stats (metrics.Metrics): Metrics the transfer is recorded in.
     """
-    start_time = time.time()
-    mytimer = t.Timer(1)
-    try:
-        total_transmitted_packets = 0 # Total transmissions
+    with Flow(conn, sock, data_packets, stats, seqnum.ALTERNATING, windowed = False) as flow:
+        mytimer = t.Timer(flow.estimator.rto)
+        send_times = flow.send_times
         transmitted_packets = 0 # Packets actually sent
 
         # Attempt to send packets
         while transmitted_packets < len(data_packets):
-            if transmitted_packets == 0:
-                pkt = packet.make(transmitted_packets % 2, bytes("FIRST", "utf-8"), bytes(data_packets[transmitted_packets], "utf-8"))
-                udt.send(pkt, sock, server_address)
-                print("Client: initialization sent!")
-            else:
-                text_to_send = data_packets[transmitted_packets] 
-                checksum = create_checksum(transmitted_packets % 2, text_to_send).encode("utf-8")
-                pkt = packet.make(transmitted_packets % 2, checksum, text_to_send)
-                udt.send(pkt, sock, server_address)
-                print("Client: Pkt sent - ", text_to_send)
+            send_segments(conn, sock, [(seqnum.wrap(transmitted_packets, seqnum.ALTERNATING), data_packets[transmitted_packets])], stats)
+            if metrics.LEVEL >= metrics.PACKETS:
+                if transmitted_packets == 0:
+                    print("Client: initialization sent!")
+                else:
+                    print("Client: Pkt sent - ", transmitted_packets)
+            send_times.setdefault(transmitted_packets, t.now())
 
             # Start timer, wait for acknowledgment of packets previously sent
             mytimer.start()
             while mytimer.running() and not mytimer.timeout():
-                rcvpkt, _ = udt.recv(sock)
-                if rcvpkt:
-                        seq, checksum, data_rcvd = packet.extract(rcvpkt)
-                        # Acknowledgement received, go to next packet
-                        if verify_checksum(seq, checksum, data_rcvd):
-                            print("Client: Ack Received - %s", data_rcvd)
-                            transmitted_packets += 1
-                            total_transmitted_packets += 1
-                            mytimer.stop()
+                ack = flow.acks.get(mytimer.time_left(), transmitted_packets)
+                # Acknowledgement received, go to next packet
+                if ack == transmitted_packets:
+                    flow.acked(send_times.pop(transmitted_packets))
+                    if transmitted_packets:
+                        stats.delivered(data_packets.length(transmitted_packets))
+                    transmitted_packets += 1
+                    flow.end = seqnum.wrap(transmitted_packets, seqnum.ALTERNATING)
+                    flow.transmitted += 1
+                    data_packets.release(transmitted_packets)
+                    mytimer.stop()
                 continue
+            if not mytimer.timeout(): continue
+
             # Timeout, resend packet
             mytimer.stop()
-            total_transmitted_packets += 1
+            flow.estimator.backoff()
+            send_times[transmitted_packets] = None
+            flow.transmitted += 1
+            flow.timeouts += 1
+            if stats.trace is not None:
+                stats.trace.record("timeout", transmitted_packets)
 
-    # Finished sending all packets, send "DONE" signal
-    finally:
-        text_to_send = "DONE"
-        pkt = packet.make(transmitted_packets % 2, bytes(text_to_send, 'utf-8'))
-        udt.send(pkt, sock, server_address)
-        print("I am DONE sending")
-
-        end_time = time.time()
-        transmission_time = end_time - start_time
-        retransmissions = total_transmitted_packets - transmitted_packets
 
-        # Summary
-        print_summary(total_transmitted_packets, retransmissions, transmission_time)
-        sock.close()
-
-
-def gbn_sender(sock, server_address, data_packets):
+def gbn_sender(conn, sock, data_packets, stats):
     """
     Sends packets using Go-Back-N protocol.
 
     Parameters:
+    - conn (Connection): The upload the flow belongs to.
     - sock (socket.socket): The UDP socket to send packets on.
-    - server_address (tuple): The server's (host, port) tuple.
-    - data_packets (list): List of data packets to send.
+    - data_packets (segments.SegmentSource): Segments to send, released once ACK'ed.
+    - stats (metrics.Metrics): Metrics the transfer is recorded in.
     """
     send_base = 0       # The start of sent, not yet ack'ed (Yellow) packets
     next_seq_num = 0    # The first usable, not yet sent (Blue) packet
+    sent_end = 0        # One past the highest packet ever sent, beyond next_seq_num after going back
     send_window = []    # The current window
 
-    start_time = time.time()
-    mytimer = t.Timer(1)
-    try:
-        total_transmitted_packets = 0
-        number_of_timeouts = 0
+    with Flow(conn, sock, data_packets, stats) as flow:
+        estimator, cc, acks, send_times = flow.estimator, flow.cc, flow.acks, flow.send_times
+        mytimer = t.Timer(estimator.rto)
+        duplicate_acks = 0
         # send_base: Number of already ack'ed packets + 1 or (# Green + 1)
         while send_base < len(data_packets):
-            # Attempt to send window_size packets at a time
-            while next_seq_num < min(send_base + window_size, len(data_packets)):
-                # Construct and send packet
-                if next_seq_num == 0:
-                    pkt = packet.make(0, bytes("FIRST", "utf-8"), bytes(data_packets[next_seq_num], "utf-8"))
-                    udt.send(pkt, sock, server_address)
-                    print("Client: initialization sent!")
-                else:
-                    text_to_send = data_packets[next_seq_num]
-                    checksum = create_checksum(next_seq_num, text_to_send).encode("utf-8")
-                    pkt = packet.make(next_seq_num, checksum, text_to_send)
-                    udt.send(pkt, sock, server_address)
-                    print("Client: Pkt sent - ", text_to_send)
-                
+            # Attempt to fill the window, as one burst
+            burst = []
+            while next_seq_num < min(send_base + current_window(conn, cc, acks), len(data_packets)):
+                # Construct packet
+                burst.append((next_seq_num, data_packets[next_seq_num]))
+                if metrics.LEVEL >= metrics.PACKETS:
+                    if next_seq_num == 0:
+                        print("Client: initialization sent!")
+                    else:
+                        print("Client: Pkt sent - ", next_seq_num)
+                send_times.setdefault(next_seq_num, t.now())
+
                 # Store packet in the send window
                 # These will be the sent, not yet ack'ed (Yellow) packets
                 send_window.append(next_seq_num)
                 next_seq_num += 1
+            send_segments(conn, sock, burst, stats)
+            if burst:
+                stats.window.record(next_seq_num - send_base)
+            sent_end = max(sent_end, next_seq_num)
+            flow.end = next_seq_num
 
             # Start timer, and wait for acknowledgement for the previously sent packets
             mytimer.start()    
             while mytimer.running() and not mytimer.timeout():
-                rcvpkt, _ = udt.recv(sock)
-                if rcvpkt:
-                    seq, checksum, data_rcvd = packet.extract(rcvpkt)
-                    if verify_checksum(seq, checksum, data_rcvd):
-                        print("Client: Ack Received - %s", data_rcvd)
-                        seq = int(data_rcvd.decode("utf-8").split('-')[-1])     # Get ACK # in data
-                        # Slide the window forward
-                        if send_window and send_window[0] == seq:
+                seq = acks.get(mytimer.time_left(), send_base)
+                if seq is not None:
+                    # Slide the window forward
+                    # After going back to a smaller window, the ACK may cover packets sent before and not resent
+                    if send_base <= seq < sent_end:
+                        '''
+                        Timer has not timed out!
+                        ACKs are cumulative, so every packet up to and including seq has gotten the ACK (Green), pop them
+                        Meaning, the send_base moves right past seq
+                        Finally, exit the inner loop and go back to the outer loop IMMEDIATELY
+                        '''
+                        mytimer.stop()
+                        flow.acked(send_times.get(seq))
+                        for acked in range(send_base, seq + 1):
+                            del send_times[acked]
+                            if acked:
+                                stats.delivered(data_packets.length(acked))
+                        del send_window[:seq + 1 - send_base]
+                        if cc is not None:
+                            cc.acked(seq + 1 - send_base)
+                        flow.transmitted += seq + 1 - send_base
+                        send_base = seq + 1
+                        next_seq_num = max(next_seq_num, send_base)
+                        flow.end = next_seq_num
+                        data_packets.release(send_base)
+                        duplicate_acks = 0
+                        break
+                    # Duplicate ACK: the receiver is still missing send_base
+                    elif seq == send_base - 1:
+                        duplicate_acks += 1
+                        if duplicate_acks == 3:
                             '''
-                            Timer has not timed out!
-                            Therefore, the next_seq_num will be incremented
-                            The first packet in the send_window has gotten the ACK (Green), so pop it
-                            Meaning, the send_base shall also increment
-                            Finally, exit the inner loop and go back to the outer loop IMMEDIATELY
+                            Fast retransmit without waiting for the timeout
+                            The receiver discarded every packet after send_base, so go back to send_base
+                            Duplicate ACKs for the rest of the old window are still counted, not acted on, until a new ACK arrives
                             '''
+                            if metrics.LEVEL >= metrics.PACKETS:
+                                print("Client: Fast retransmit from - ", send_base)
+                            if stats.trace is not None:
+                                stats.trace.record("fast_retransmit", send_base)
                             mytimer.stop()
-                            next_seq_num = send_window[-1] + 1    
-                            send_window.pop(0)
-                            total_transmitted_packets += 1
-                            send_base = seq + 1
+                            if cc is not None:
+                                cc.fast_retransmit(len(send_window), send_base, next_seq_num)
+                            for unacked in send_window:
+                                send_times[unacked] = None
+                            flow.transmitted += len(send_window)
+                            next_seq_num = send_base
+                            send_window = []
+                            flow.fast_retransmits += 1
                             break
                 continue
             if not mytimer.timeout(): continue  # To go back to outer loop
 
             # Handle timeout for unacknowledged packets
             mytimer.stop()
-            total_transmitted_packets += len(send_window)   # Retransmit all packets in the current window
+            estimator.backoff()
+            if cc is not None:
+                cc.timeout(len(send_window), send_base, next_seq_num)
+            for unacked in send_window:
+                send_times[unacked] = None
+            flow.transmitted += len(send_window)   # Retransmit all packets in the current window
             next_seq_num = send_base    # next_seq_num will start from the beginning
             send_window = []    # Will resend all packets, so current window must reset
-            number_of_timeouts += 1
+            flow.timeouts += 1
+            duplicate_acks = 0
+            if stats.trace is not None:
+                stats.trace.record("timeout", send_base)
+
+
+def sr_sender(conn, sock, data_packets, stats):
+    """
+    Sends packets using Selective Repeat protocol.
+
+    Each packet in the window has its own timer, and only the packets whose
+    timer expires are retransmitted. The receiver's SACKs reveal the holes in
+    what it holds, which are retransmitted without waiting for their timers.
+    With FEC, parity segments follow every group so that the receiver can
+    rebuild lost segments without any retransmission.
 
-    # Finished sending all the packets, send "DONE" signal
+    Parameters:
+    - conn (Connection): The upload the flow belongs to.
+    - sock (socket.socket): The UDP socket to send packets on.
+    - data_packets (segments.SegmentSource): Segments to send, released once ACK'ed.
+    - stats (metrics.Metrics): Metrics the transfer is recorded in.
+    """
+    send_base = 0       # The start of sent, not yet ack'ed packets
+    next_seq_num = 0    # The first usable, not yet sent packet
+    acked = set()       # Ack'ed packets inside the window
+    highest = []        # Heap of the SACK_THRESHOLD highest packets ever ack'ed
+    judged = 0          # Holes before this one were retransmitted or ack'ed already
+    timers = t.TimerQueue()
+    code = fec.Code(conn.fec_group, conn.fec_parity, len(data_packets)) if conn.fec_group else None
+
+    with Flow(conn, sock, data_packets, stats) as flow:
+        estimator, cc, acks, send_times = flow.estimator, flow.cc, flow.acks, flow.send_times
+        parity_packets = []
+        while send_base < len(data_packets):
+            # Send every packet that became eligible as the window slid, as one burst
+            burst = []
+            while next_seq_num < min(send_base + current_window(conn, cc, acks), len(data_packets)):
+                burst.append((next_seq_num, data_packets[next_seq_num]))
+                if metrics.LEVEL >= metrics.PACKETS:
+                    print("Client: Pkt sent - ", next_seq_num)
+                timers.start(next_seq_num, estimator.rto)
+                send_times[next_seq_num] = t.now()
+                flow.transmitted += 1
+                # A completed group is followed by its parity segments
+                if code is not None and next_seq_num and next_seq_num + 1 == code.group_end(next_seq_num):
+                    start = code.group_start(next_seq_num)
+                    parity = fec.encode([data_packets[seq] for seq in range(start, next_seq_num + 1)], conn.fec_parity)
+                    parity_packets += [packet.make(start + j, data, packet.FEC) for j, data in enumerate(parity)]
+                next_seq_num += 1
+            flow.end = next_seq_num
+            send_segments(conn, sock, burst, stats)
+            if parity_packets:
+                udt.send_batch(parity_packets, sock, conn.server_address)
+                stats.counters["parity"] += len(parity_packets)
+                parity_packets = []
+            if burst:
+                stats.window.record(next_seq_num - send_base)
+
+            # Sleep until an ACK arrives or the earliest packet timer expires
+            ack = acks.get(timers.time_left(), send_base)
+            if ack is not None:
+                # The SACK also covers packets whose own ACK was lost: every packet
+                # before the receiver's next expected one and every packet it holds
+                covered = [ack]
+                if acks.sack is not None:
+                    cumulative, held = acks.sack
+                    covered = itertools.chain(covered, range(send_base, cumulative), held)
+                for seq in covered:
+                    if not send_base <= seq < next_seq_num or seq in acked:
+                        continue
+                    timers.stop(seq)
+                    sent_at = send_times.pop(seq)
+                    flow.acked(sent_at if seq == ack else None)
+                    if cc is not None:
+                        cc.acked()
+                    if seq:
+                        stats.delivered(data_packets.length(seq))
+                    acked.add(seq)
+                    if len(highest) < SACK_THRESHOLD:
+                        heapq.heappush(highest, seq)
+                    elif seq > highest[0]:
+                        heapq.heapreplace(highest, seq)
+                # Slide the window over every in-order ack'ed packet
+                while send_base in acked:
+                    acked.remove(send_base)
+                    send_base += 1
+                data_packets.release(send_base)
+
+                # Retransmit the holes SACK_THRESHOLD later packets were received beyond, once each;
+                # the per-packet timers catch a lost retransmission
+                # With FEC only packets beyond the hole's group count, giving its parity the chance to rebuild it,
+                # unless the window cannot reach that far past the group, which would leave the hole to its timer
+                # Only the holes after the last one judged are looked at, up to the SACK_THRESHOLD-th highest ack'ed packet
+                lost = []
+                if acks.sack is not None and len(highest) == SACK_THRESHOLD:
+                    reach = send_base + current_window(conn, cc, acks)   # One past the last packet the window may send
+                    judged = max(judged, send_base)
+                    while judged < next_seq_num:
+                        if code is None or code.group_end(judged) + SACK_THRESHOLD > reach:
+                            if judged >= highest[0]:
+                                break
+                        elif code.group_end(judged) > highest[0]:
+                            break
+                        if judged not in acked:
+                            lost.append(judged)
+                        judged += 1
+                if lost:
+                    if cc is not None:
+                        cc.fast_retransmit(next_seq_num - send_base, lost[0], next_seq_num)
+                    send_segments(conn, sock, [(seq, data_packets[seq]) for seq in lost], stats)
+                    for seq in lost:
+                        if metrics.LEVEL >= metrics.PACKETS:
+                            print("Client: Fast retransmit - ", seq)
+                        if stats.trace is not None:
+                            stats.trace.record("fast_retransmit", seq)
+                        timers.start(seq, estimator.rto)
+                        send_times[seq] = None
+                    flow.transmitted += len(lost)
+                    flow.fast_retransmits += len(lost)
+
+            # Retransmit only the packets that timed out
+            expired = timers.expired()
+            if expired:
+                estimator.backoff()
+                # Per-packet timers catch single losses while the other packets keep being ACK'ed,
+                # so they count as a fast retransmit rather than a stalled path
+                if cc is not None:
+                    cc.fast_retransmit(next_seq_num - send_base, min(expired), next_seq_num)
+            send_segments(conn, sock, [(seq, data_packets[seq]) for seq in expired], stats)
+            for seq in expired:
+                if metrics.LEVEL >= metrics.PACKETS:
+                    print("Client: Pkt resent - ", seq)
+                if stats.trace is not None:
+                    stats.trace.record("timeout", seq)
+                timers.start(seq, estimator.rto)
+                send_times[seq] = None
+                flow.transmitted += 1
+                flow.timeouts += 1
+
+
+# Senders by protocol number; a sender sends a flow's segments, the initialization first,
+# until every one is acknowledged, running its windowing strategy in a Flow that records what happened in stats
+SENDERS = {0: snw_sender, 1: gbn_sender, 2: sr_sender}
+
+
+def upload(conn, stats = None):
+    """
+    Uploads a file: negotiates with the server, lets it fill in the chunks it holds,
+    sends the missing ranges over parallel flows until it has the whole file, then
+    ends the transfer once the server has checked its copy against the file's digest.
+
+    Parameters:
+        conn (Connection): The upload, updated with the granted MSS and the chosen codec.
+        stats (metrics.Metrics): Metrics the transfer is recorded in, new ones if None.
+
+    Returns:
+        metrics.Metrics: Metrics of the transfer.
+
+    Raises:
+        ValueError: If the MSS does not fit the path or the server lacks the codec.
+        ConnectionError: If the server stops answering, the transfer makes no progress or the server's copy does not match.
+    """
+    stats = metrics.Metrics(trace = conn.trace) if stats is None else stats
+
+    # Segments must cross the path without fragmentation
+    limit = udt.max_payload(conn.mtu or udt.path_mtu(conn.server_address)) - packet.HEADER_SIZE
+    proposed = limit if conn.mss is None else conn.mss
+    if not 0 < proposed <= limit:
+        raise ValueError(f"MSS must be between 1 and {limit} bytes on this path.")
+
+    # The file's digest is computed while its ranges are sent, so that the transfer ends right after the last one
+    hashing = concurrent.futures.ThreadPoolExecutor(max_workers = 1)
+    file_digest = hashing.submit(digest.of_file, conn.file_path)
+
+    # Agree on the MSS and learn what the server already has, e.g. from an interrupted run
+    start_time = t.now()
+    try:
+        answer = query(conn, proposed)
+        if answer is None:
+            raise ConnectionError("The server did not answer the initialization.")
+        conn.mss, missing, codecs, missing_bytes = answer
+
+        # Compress only files that are worth it, with a codec the server has
+        codec = compress.choose(conn.file_path, conn.codec, codecs)
+        if codec is None:
+            raise ValueError(f"The server only supports the codecs {', '.join(codecs)}.")
+        conn.codec = codec
+
+        # Let the server fill in the chunks it holds from other uploads, e.g. of an earlier version of the file
+        if conn.dedup and missing:
+            copied = deduplicate(conn, missing)
+            answer = query(conn, conn.mss) if copied else None
+            if answer is not None:
+                stats.counters["dedup_bytes"] += copied
+                missing, missing_bytes = answer[1], answer[3]
+
+        # Send the missing ranges over parallel flows until the server has the whole file
+        # The server lists only the first missing ranges, so progress is judged by the bytes missing in all
+        while missing:
+            pieces = ranges.split(missing, conn.flows, conn.mss)
+            if len(pieces) == 1:
+                # A single flow runs on the calling thread, which also keeps simulations (sim.py) on one timeline
+                stats.merge(send_range(conn, pieces[0]))
+            else:
+                with concurrent.futures.ThreadPoolExecutor(max_workers = conn.flows) as pool:
+                    for flow_stats in pool.map(lambda byte_range: send_range(conn, byte_range), pieces):
+                        stats.merge(flow_stats)
+            stats.counters["flows"] += len(pieces)
+
+            answer = query(conn, conn.mss)
+            if answer is None:
+                raise ConnectionError("The server did not answer the initialization.")
+            if answer[3] >= missing_bytes:
+                raise ConnectionError("The transfer made no progress.")
+            missing, missing_bytes = answer[1], answer[3]
+        else:
+            if metrics.LEVEL >= metrics.SUMMARY and not stats.counters["flows"]:
+                print("The server already has the whole file.")
+
+        # The server only keeps its copy under the file's name if it matches the file's digest
+        verdict = finish(conn, file_digest.result())
+        if verdict is None:
+            raise ConnectionError("The server did not answer the end of the transfer.")
+        if verdict == digest.MISMATCH:
+            raise ConnectionError("The server's copy did not match the file's digest and was discarded; upload it again.")
+        if verdict != digest.OK:
+            raise ConnectionError("The server is missing part of the file.")
+        if metrics.LEVEL >= metrics.SUMMARY:
+            print("The server verified the file's digest.")
     finally:
-        text_to_send = "DONE"
-        pkt = packet.make(next_seq_num, bytes(text_to_send, 'utf-8'))
-        udt.send(pkt, sock, server_address)
-        print("I am DONE sending")
-
-        end_time = time.time()
-        transmission_time = end_time - start_time
-        retransmissions = total_transmitted_packets - len(data_packets)
-
-        # Summary
-        print_summary(total_transmitted_packets, retransmissions, transmission_time)
-        print("Number of timeouts: ", number_of_timeouts)
-        sock.close()
+        hashing.shutdown(wait = False, cancel_futures = True)
+        udt.drain()
+        stats.gauges["time"] = t.now() - start_time
+    return stats
+
+
+def report(stats):
+    """
+    Prints the transfer's metrics and writes them and the trace to the files asked for.
+
+    Parameters:
+        stats (metrics.Metrics): Metrics of the finished transfer.
+    """
+    stats.gauges.update(udt.CHANNEL.summary())
+    if metrics.LEVEL >= metrics.SUMMARY:
+        stats.print_summary()
+    if metrics_path is not None:
+        stats.dump(metrics_path)
+    if trace_path is not None:
+        stats.trace.dump(trace_path)
 
 
 def main():
     """
     Main function to start the client.
     """
-    # Get chosen file from cache
-    data = b''
-    with open(file_path, "rb") as file:
-        data += file.read()
-        
-    # Separate data into packets of size 'MSS'
-    data_packets = [data[i:i + MSS] for i in range(0, len(data), MSS)]
-    # Calculate number needed to determine the number of packets transmitted for the server side
-    max_packets_transmitted = 2 if protocol == 0 else len(data_packets) + 1
-    data_packets.insert(0, extension + f":{max_packets_transmitted}")
-
-    # Create a UDP socket
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sock.setblocking(0)	 # making the socket non-blocking
-    server_address = (HOST, port)
+    try:
+        conn = Connection(CACHE + file, port, protocol, window_size, mss = mss, mtu = mtu, rto_min = rto_min, rto_max = rto_max,
+                          congestion_control = congestion_control, flows = flows, codec = codec, level = level, dedup = dedup,
+                          fec_group = fec_group, fec_parity = fec_parity, transfer_id = transfer_id,
+                          sndbuf = sndbuf, rcvbuf = rcvbuf, trace = trace_path is not None)
+    except ValueError as error:
+        print(f"Error: {error}")
+        sys.exit(2)
 
-    if protocol == 0:
-        snw_sender(sock, server_address, data_packets)
-    elif protocol == 1:
-        gbn_sender(sock, server_address, data_packets)
+    stats = metrics.Metrics(trace = conn.trace)
+    try:
+        upload(conn, stats)
+    except ValueError as error:
+        print(f"Error: {error}")
+        sys.exit(2)
+    except ConnectionError as error:
+        print(f"Error: {error}")
+        sys.exit(1)
+    finally:
+        report(stats)
 
 
 if __name__ == "__main__":
     # Ask for a port number and the protocol to use
+    usage = 'Usage : "python client.py -p port -r protocol -f file -n window_size (0 - SnW, 1 - GBN, 2 - SR)"\n[port: port number of the server to connect]\n[protocol: protocol the server will use (SnW, GBN or SR)]\n[file: file that will be sent to server]\n[window_size: window size used by the sender/receiver in GBN and SR]\nOptional: -tmin min_rto -tmax max_rto [bounds of the adaptive retransmission timeout in seconds]\n          -c checksum [inet (default), crc32 or crc32c (pure Python, about 8k packets/s, unless the crc32c package is installed); must match the server]\n          -mss bytes [proposed maximum segment size, 1000 by default; auto for the largest the path MTU allows]\n          -mtu bytes [path MTU, probed by default] -sndbuf bytes -rcvbuf bytes [socket buffer sizes, system default otherwise]\n          -k flows [parallel flows sending ranges of the file, 1 by default] -id transfer_id [resumes that transfer, derived from the file by default]\n          -cc control [none (default) or aimd: congestion window of GBN and SR, at most window_size]\n          -z codec[:level] [none (default), auto (sampled per file), zlib, lzma or zstd when installed]\n          -dedup on|off [sends only the content-defined chunks the server does not hold yet, off by default]\n          -fec group:parity [SR only: parity segments sent after every group of data segments, none by default]\n          -v level [0 - quiet, 1 - summary (default), 2 - every packet] -trace file [.jsonl for JSON lines] -metrics file [JSON summary]\n          -loss p -ge to_bad,to_good[,bad_loss] -corrupt p -delay ms -jitter ms -reorder p -bw mbps -seed n [channel impairments of the data path]'
     if len(sys.argv) < 9:
-        print('Usage : "python client.py -p port -r protocol -f file -n window_size (0 - SnW, 1 - GBN)"\n[port: port number of the server to connect]\n[protocol: protocol the server will use (SnW or GBN)]\n[file: file that will be sent to server]\n[window_size: window size used by the sender/receiver in GBN]')
+        print(usage)
         sys.exit(2)
     
     # Parse command-line arguments
@@ -276,12 +1041,37 @@ if __name__ == "__main__":
     protocol = int(args['-r'])
     file = args['-f']
     window_size = int(args['-n'])
+    rto_min = float(args.get('-tmin', RTO_MIN))
+    rto_max = float(args.get('-tmax', RTO_MAX))
+    integrity.MODE = args.get('-c', integrity.MODE)
+    if integrity.MODE not in integrity.MODES:
+        print(f"Error: Checksum must be one of {', '.join(integrity.MODES)}.")
+        print(usage)
+        sys.exit(2)
+    udt.configure(args)
+    trace_path, metrics_path = metrics.configure(args)
+    congestion_control = args.get('-cc', "none")
+    flows = int(args.get('-k', 1))
+    mss = None if args.get('-mss') == "auto" else int(args.get('-mss', MSS))
+    mtu = int(args['-mtu']) if '-mtu' in args else None
+    sndbuf = int(args['-sndbuf']) if '-sndbuf' in args else None
+    rcvbuf = int(args['-rcvbuf']) if '-rcvbuf' in args else None
+    transfer_id = args.get('-id')
+
+    if congestion_control not in ("none", "aimd"):
+        print("Error: Congestion control must be none or aimd.")
+        sys.exit(2)
+    congestion_control = congestion_control == "aimd"
+
+    codec, _, level = args.get('-z', "none").partition(':')
+    level = int(level) if level else None
+
+    dedup = args.get('-dedup', "off") == "on"
 
-    extension = file.split('.')[-1].lower()
-    file_path = CACHE + file
+    fec_group, fec_parity = (0, 0) if args.get('-fec', "none") == "none" else (int(value) for value in args['-fec'].split(':'))
 
     # Ensure file exists
-    if not os.path.exists(file_path):
+    if not os.path.exists(CACHE + file):
         print("Error: File does not exist.")
         sys.exit(2)
 
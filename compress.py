@@ -0,0 +1,138 @@
+# compress.py - Optional payload compression: codecs, compressibility detection and streaming
+#
+# The client compresses each range it sends as one stream, the server decompresses it
+# as the segments are delivered in order, so ranges and offsets stay those of the file.
+import lzma
+import os
+import tempfile
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+LEVELS = {"zlib": 6, "lzma": 6, "zstd": 3}    # Default level of each codec
+SAMPLES = 8             # Chunks of the file sampled to decide whether it compresses
+SAMPLE_SIZE = 1 << 14   # Bytes of each sample
+THRESHOLD = 0.9         # Largest compressed/raw ratio of the samples worth compressing for
+CHUNK = 1 << 16         # Bytes read at a time while compressing a range
+
+
+# Gets the codecs this side supports, the preferred one last
+def available():
+    return ["lzma", "zlib"] + (["zstd"] if zstandard is not None else [])
+
+
+def compressor(codec, level = None):
+    """
+    Creates a streaming compressor.
+
+    Parameters:
+        codec (str): One of available().
+        level (int): Compression level, the codec's default in LEVELS otherwise.
+
+    Returns:
+        object: Compressor with compress(data) and flush() methods.
+    """
+    level = LEVELS[codec] if level is None else level
+    if codec == "zlib":
+        return zlib.compressobj(level)
+    if codec == "lzma":
+        return lzma.LZMACompressor(preset = level)
+    return zstandard.ZstdCompressor(level = level).compressobj()
+
+
+class Decompressor(object):
+    """
+    Streaming decompressor of one codec, fed the compressed stream in order.
+    """
+
+    def __init__(self, codec):
+        if codec == "zlib":
+            self._decompressor = zlib.decompressobj()
+        elif codec == "lzma":
+            self._decompressor = lzma.LZMADecompressor()
+        else:
+            self._decompressor = zstandard.ZstdDecompressor().decompressobj()
+
+    # Gets the data decompressed from the next part of the stream
+    def decompress(self, data):
+        return self._decompressor.decompress(data)
+
+    # Gets the data still buffered once the whole stream was fed
+    def flush(self):
+        flush = getattr(self._decompressor, "flush", None)     # LZMA returns everything as it goes
+        return flush() if flush is not None else b''
+
+
+def ratio(file_path):
+    """
+    Estimates how well a file compresses from SAMPLES chunks spread over it.
+
+    Parameters:
+        file_path (str): Path of the file.
+
+    Returns:
+        float: Compressed size of the samples over their raw size, 1 for an empty file.
+    """
+    size = os.path.getsize(file_path)
+    raw = compressed = 0
+    with open(file_path, "rb") as file:
+        # Each sample on its own: in small files they overlap, and zlib would find the repeats
+        for i in range(SAMPLES):
+            file.seek(max(0, size - SAMPLE_SIZE) * i // max(1, SAMPLES - 1))
+            sample = file.read(SAMPLE_SIZE)
+            raw += len(sample)
+            compressed += len(zlib.compress(sample, 1))
+            if size <= SAMPLE_SIZE:
+                break
+    return compressed / raw if raw else 1
+
+
+def choose(file_path, requested, supported):
+    """
+    Picks the codec a file is sent with.
+
+    Parameters:
+        file_path (str): Path of the file.
+        requested (str): none, auto or a codec.
+        supported (list): Codecs the server supports.
+
+    Returns:
+        str: The codec, none when the file is not worth compressing, None when the server lacks the requested codec.
+    """
+    if requested != "auto":
+        return requested if requested == "none" or requested in supported else None
+    if ratio(file_path) > THRESHOLD:
+        return "none"
+    shared = [codec for codec in available() if codec in supported]
+    return shared[-1] if shared else "none"
+
+
+def compress_range(file_path, offset, length, codec, level = None):
+    """
+    Compresses a range of a file into a temporary file, CHUNK bytes at a time.
+
+    Parameters:
+        file_path (str): Path of the file.
+        offset (int): First byte of the range.
+        length (int): Bytes in the range.
+        codec (str): One of available().
+        level (int): Compression level, the codec's default otherwise.
+
+    Returns:
+        str: Path of the compressed stream, to be removed by the caller.
+    """
+    stream = compressor(codec, level)
+    with open(file_path, "rb") as source, tempfile.NamedTemporaryFile(delete = False) as target:
+        source.seek(offset)
+        while length > 0:
+            data = source.read(min(CHUNK, length))
+            if not data:
+                break
+            target.write(stream.compress(data))
+            length -= len(data)
+        target.write(stream.flush())
+    return target.name
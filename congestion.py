@@ -0,0 +1,51 @@
+# congestion.py - AIMD congestion control (RFC 5681): slow start, congestion avoidance, multiplicative decrease
+
+class AIMD(object):
+    INITIAL_WINDOW = 2  # Packets sent before the first ACK
+    MIN_SSTHRESH = 2    # Lowest slow start threshold after a loss
+
+    def __init__(self, max_window):
+        self.max_window = max_window
+        self.cwnd = min(self.INITIAL_WINDOW, max_window)
+        self.ssthresh = max_window
+        self.recover = 0    # First sequence number sent after the last decrease
+        self.decreases = 0
+
+    # Grows the window for count newly acknowledged packets:
+    # one packet per ACK below ssthresh (slow start), one packet per window above it (congestion avoidance)
+    def acked(self, count = 1):
+        for _ in range(count):
+            if self.cwnd < self.ssthresh:
+                self.cwnd += 1
+            else:
+                self.cwnd += 1 / self.cwnd
+        self.cwnd = min(self.cwnd, self.max_window)
+
+    # Halves the threshold once per congestion event: losses of packets sent
+    # before the last decrease belong to the event that caused it
+    def _decrease(self, in_flight, seq, next_seq):
+        if seq < self.recover:
+            return False
+        self.ssthresh = max(in_flight / 2, self.MIN_SSTHRESH)
+        self.recover = next_seq
+        self.decreases += 1
+        return True
+
+    # Restarts slow start after a retransmission timeout of packet seq, next_seq being the next unsent packet
+    def timeout(self, in_flight, seq, next_seq):
+        self._decrease(in_flight, seq, next_seq)
+        self.cwnd = 1
+
+    # Halves the window after a loss of packet seq detected while ACKs still arrive
+    # (triple duplicate ACK), next_seq being the next unsent packet
+    def fast_retransmit(self, in_flight, seq, next_seq):
+        if self._decrease(in_flight, seq, next_seq):
+            self.cwnd = self.ssthresh
+
+    # Gets the number of packets that may be in flight
+    def window(self):
+        return max(1, int(self.cwnd))
+
+    # Gets the controller state, for the transfer metrics
+    def summary(self):
+        return {"cwnd": self.cwnd, "ssthresh": self.ssthresh, "window_decreases": self.decreases}
@@ -0,0 +1,118 @@
+# digest.py - End-to-end file digest, computed block by block as the data streams past
+#
+# The digest of a file is the SHA-256 of the SHA-256 digests of its BLOCK-byte blocks, so that
+# the blocks can be hashed independently. A block is hashed as its data is written, as long as
+# the data comes in order from its start; a block whose data came out of order, e.g. because two
+# flows' ranges meet in it, a transfer resumed or deduplication filled in part of it, is read back
+# once complete. Verifying an upload costs a few blocks of reading, never the whole file.
+import hashlib
+import os
+import sys
+import time
+
+BLOCK = 1 << 20     # Bytes hashed on their own
+
+# Verdicts of the teardown, answered by the server in the FIN-ACK
+OK = "ok"               # The file matches the digest and has its final name
+MISMATCH = "mismatch"   # The file does not match the digest and was discarded
+MISSING = "missing"     # Part of the file has not been received
+
+
+class Digest(object):
+    """
+    Streaming digest of a file written at offsets.
+
+    Attributes:
+        size (int): Size of the file in bytes.
+        reread (int): Blocks read back by hexdigest.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.reread = 0
+        self._hashing = {}  # Hashes of the blocks being written in order, with the offset they continue at, keyed by block
+        self._stale = set() # Blocks written out of order, read back by hexdigest
+        self._blocks = {}   # Digests of the blocks written in order, keyed by block
+
+    # Hashes data written at offset, the blocks it reaches out of order left to be read back
+    def update(self, offset, data):
+        view = memoryview(data)
+        while view:
+            block = offset // BLOCK
+            length = min(len(view), (block + 1) * BLOCK - offset)
+            if block not in self._stale:
+                hashing = self._hashing.get(block)
+                if hashing is None and offset == block * BLOCK and block not in self._blocks:
+                    hashing = self._hashing[block] = [hashlib.sha256(), offset]
+                if hashing is not None and hashing[1] == offset:
+                    hashing[0].update(view[:length])
+                    hashing[1] += length
+                    if hashing[1] == min((block + 1) * BLOCK, self.size):
+                        self._blocks[block] = hashing[0].digest()
+                        del self._hashing[block]
+                else:
+                    # Written again or out of order
+                    self._stale.add(block)
+                    self._hashing.pop(block, None)
+                    self._blocks.pop(block, None)
+            offset += length
+            view = view[length:]
+
+    def hexdigest(self, read):
+        """
+        Gets the digest of the file, reading back the blocks that were not hashed in order.
+
+        Parameters:
+            read (function): Reads length bytes at offset of the file, read(offset, length).
+
+        Returns:
+            str: Hexadecimal digest.
+        """
+        digest = hashlib.sha256()
+        for block in range((self.size + BLOCK - 1) // BLOCK):
+            block_digest = self._blocks.get(block)
+            if block_digest is None:
+                offset = block * BLOCK
+                block_digest = hashlib.sha256(read(offset, min(BLOCK, self.size - offset))).digest()
+                self.reread += 1
+            digest.update(block_digest)
+        return digest.hexdigest()
+
+
+# Gets the digest of a whole file on disk, reading it once
+def of_file(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        return Digest(os.fstat(fd).st_size).hexdigest(lambda offset, length: os.pread(fd, length, offset))
+    finally:
+        os.close(fd)
+
+
+if __name__ == "__main__":
+    # Throughput: python digest.py [file]
+    # The same digest from one pass over the file, streamed in order and from ranges written out of order
+    path = sys.argv[1] if len(sys.argv) > 1 else os.path.join("ClientCache", "video.mp4")
+    with open(path, "rb") as file:
+        data = file.read()
+
+    start = time.perf_counter()
+    expected = of_file(path)
+    elapsed = time.perf_counter() - start
+
+    streamed = Digest(len(data))
+    for offset in range(0, len(data), 1000):
+        streamed.update(offset, data[offset:offset + 1000])
+    assert streamed.hexdigest(None) == expected
+
+    # Four flows, their segments interleaved
+    flows = Digest(len(data))
+    bounds = [len(data) * k // 4 for k in range(5)]
+    offsets = [list(range(bounds[k], bounds[k + 1], 1000)) for k in range(4)]
+    for i in range(max(len(flow) for flow in offsets)):
+        for k, flow in enumerate(offsets):
+            if i < len(flow):
+                flows.update(flow[i], data[flow[i]:min(flow[i] + 1000, bounds[k + 1])])
+    assert flows.hexdigest(lambda offset, length: data[offset:offset + length]) == expected
+
+    print(f"{os.path.basename(path)}: {expected}, {len(data) / elapsed / 1e6:.0f} MB/s, "
+          f"{flows.reread} of {(len(data) + BLOCK - 1) // BLOCK} blocks read back after four flows")
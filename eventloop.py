@@ -0,0 +1,104 @@
+# eventloop.py - A single-threaded event loop built on selectors
+import collections
+import heapq
+import itertools
+import selectors
+import socket
+import threading
+import time
+
+class EventLoop(object):
+
+    def __init__(self):
+        self._selector = selectors.DefaultSelector()
+        self._timers = []
+        self._order = itertools.count()
+        self._stopped = False
+        self._ready = collections.deque()   # Callbacks handed over by other threads
+        self._lock = threading.Lock()
+        # stop() and call_soon_threadsafe() may come from another thread, and write to this pair to wake up select
+        self._wakeup, self._waker = socket.socketpair()
+        self._wakeup.setblocking(False)
+        self._waker.setblocking(False)
+        self._selector.register(self._wakeup, selectors.EVENT_READ, self._drain_wakeup)
+
+    def _drain_wakeup(self):
+        try:
+            while self._wakeup.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+        with self._lock:
+            ready, self._ready = self._ready, collections.deque()
+        for callback in ready:
+            callback()
+
+    # Calls callback() on the loop's thread as soon as it can; safe to call from any thread
+    def call_soon_threadsafe(self, callback):
+        with self._lock:
+            self._ready.append(callback)
+        try:
+            self._waker.send(b"\0")
+        except OSError:
+            pass
+
+    # Calls callback() whenever sock is readable
+    def add_reader(self, sock, callback):
+        self._selector.register(sock, selectors.EVENT_READ, callback)
+
+    # Stops watching sock
+    def remove_reader(self, sock):
+        self._selector.unregister(sock)
+
+    # Calls callback() once, after delay seconds; returns a handle for cancel()
+    def call_later(self, delay, callback):
+        handle = [time.time() + delay, next(self._order), callback]
+        heapq.heappush(self._timers, handle)
+        return handle
+
+    # Cancels a callback scheduled with call_later()
+    def cancel(self, handle):
+        handle[2] = None
+
+    # Gets the amount of time left before the next scheduled callback, or None if there is none
+    def time_left(self):
+        while self._timers and self._timers[0][2] is None:
+            heapq.heappop(self._timers)
+        if self._timers:
+            return max(0, self._timers[0][0] - time.time())
+        else:
+            return None
+
+    # Waits for readable sockets or the next scheduled callback, at most timeout seconds, and runs what is ready
+    def run_once(self, timeout = None):
+        time_left = self.time_left()
+        if time_left is not None and (timeout is None or time_left < timeout):
+            timeout = time_left
+
+        for key, _ in self._selector.select(timeout):
+            key.data()
+
+        now = time.time()
+        while self._timers and (self._timers[0][2] is None or self._timers[0][0] <= now):
+            _, _, callback = heapq.heappop(self._timers)
+            if callback is not None:
+                callback()
+
+    # Runs until stop() is called, even before run(), or nothing is left to wait for
+    def run(self):
+        while not self._stopped and (len(self._selector.get_map()) > 1 or self.time_left() is not None):
+            self.run_once()
+
+    # Makes run() return after the current iteration; safe to call from any thread
+    def stop(self):
+        self._stopped = True
+        try:
+            self._waker.send(b"\0")
+        except OSError:
+            pass
+
+    # Releases the selector
+    def close(self):
+        self._selector.close()
+        self._wakeup.close()
+        self._waker.close()
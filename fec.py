@@ -0,0 +1,189 @@
+# fec.py - Forward error correction: XOR parity over groups of data segments
+#
+# The data segments (sequence numbers FIRST to end - 1) are cut into groups of `group`
+# consecutive segments, each followed by `parity` parity segments. Parity j of a group is
+# the XOR of the group's segments j, j + parity, j + 2 * parity, ... zero-padded to the
+# longest of them, and rebuilds any single one of them that is lost. Interleaving lets a
+# group survive up to `parity` losses as long as no two fall on the same parity segment.
+# The redundancy is parity / group.
+import os
+import sys
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+FIRST = 1   # Sequence number of the first data segment, 0 being the initialization
+
+
+def xor(segments):
+    """
+    XORs segments of possibly different lengths, zero-padding the shorter ones.
+
+    XORing them as little-endian integers pads with zeros for free and runs at C speed.
+
+    Parameters:
+        segments (list): Segments to combine.
+
+    Returns:
+        bytes: XOR of the segments, as long as the longest.
+    """
+    value = 0
+    for segment in segments:
+        value ^= int.from_bytes(segment, "little")
+    return value.to_bytes(max(len(segment) for segment in segments), "little")
+
+
+def encode(segments, parity):
+    """
+    Computes the parity segments of one group.
+
+    Uses one NumPy XOR reduction per parity segment over a matrix of the group when
+    NumPy is installed, xor otherwise.
+
+    Parameters:
+        segments (list): Data segments of the group, in sequence order.
+        parity (int): Number of parity segments of a group.
+
+    Returns:
+        list: Parity segment j covering segments j, j + parity, ..., for each j.
+    """
+    count = min(parity, len(segments))
+    if numpy is None:
+        return [xor(segments[j::parity]) for j in range(count)]
+
+    matrix = numpy.zeros((len(segments), max(len(segment) for segment in segments)), dtype=numpy.uint8)
+    for row, segment in enumerate(segments):
+        matrix[row, :len(segment)] = numpy.frombuffer(segment, dtype=numpy.uint8)
+    return [numpy.bitwise_xor.reduce(matrix[j::parity], axis=0)[:max(len(segment) for segment in segments[j::parity])].tobytes()
+            for j in range(count)]
+
+
+class Code(object):
+    """
+    Layout of the groups and parity segments, shared by the sender and the receiver.
+
+    A parity segment is identified by the sequence number of the first segment it covers.
+
+    Attributes:
+        group (int): Data segments per group.
+        parity (int): Parity segments per group.
+        end (int): Sequence number after the last data segment.
+    """
+
+    def __init__(self, group, parity, end):
+        self.group = group
+        self.parity = parity
+        self.end = end
+
+    # Gets the first sequence number of the group holding seq
+    def group_start(self, seq):
+        return seq - (seq - FIRST) % self.group
+
+    # Gets the sequence number after the last one of the group holding seq
+    def group_end(self, seq):
+        return min(self.group_start(seq) + self.group, self.end)
+
+    # Gets the first sequence number covered by the parity segment covering seq
+    def parity_of(self, seq):
+        return self.group_start(seq) + (seq - FIRST) % self.group % self.parity
+
+    # Gets the sequence numbers covered by the parity segment whose first one is start
+    def members(self, start):
+        return range(start, self.group_end(start), self.parity)
+
+
+class Decoder(Code):
+    """
+    Receiver side: rebuilds lost data segments from the parity segments.
+
+    Keeps the segments received in every group that is not completely delivered yet,
+    and the parity segments still missing two or more of theirs.
+
+    Attributes:
+        length (callable): Gets the length of a data segment from its sequence number.
+        received (dict): Data segments received or rebuilt, keyed by sequence number.
+        parities (dict): Parity segments waiting for their members, keyed by their first sequence number.
+        base (int): First sequence number of the oldest group still kept.
+        recovered (int): Data segments rebuilt so far.
+    """
+
+    def __init__(self, group, parity, end, length):
+        super().__init__(group, parity, end)
+        self.length = length
+        self.received = {}
+        self.parities = {}
+        self.base = FIRST
+        self.recovered = 0
+
+    # Records a received data segment; returns the (seq, data) segments it lets rebuild
+    def add(self, seq, data):
+        if not self.base <= seq < self.end or seq in self.received:
+            return []
+        self.received[seq] = bytes(data)
+        return self._rebuild(self.parity_of(seq))
+
+    # Records a received parity segment whose first sequence number is start; returns the segment it rebuilds, if any
+    def add_parity(self, start, data):
+        if not self.base <= start < self.end or self.parity_of(start) != start or start in self.parities:
+            return []
+        self.parities[start] = bytes(data)
+        return self._rebuild(start)
+
+    def _rebuild(self, start):
+        data = self.parities.get(start)
+        if data is None:
+            return []
+        missing = [seq for seq in self.members(start) if seq not in self.received]
+        if len(missing) > 1:
+            return []
+        del self.parities[start]
+        if not missing:
+            return []
+        seq = missing[0]
+        segments = [data] + [self.received[member] for member in self.members(start) if member != seq]
+        rebuilt = self.received[seq] = xor(segments)[:self.length(seq)]
+        self.recovered += 1
+        return [(seq, rebuilt)]
+
+    # Drops the groups that end at or before seq, whose segments were all delivered
+    def forget(self, seq):
+        base = self.group_start(seq) if seq < self.end else self.end
+        if base > self.base:
+            self.received = {member: data for member, data in self.received.items() if member >= base}
+            self.parities = {start: data for start, data in self.parities.items() if start >= base}
+            self.base = base
+
+
+if __name__ == "__main__":
+    # Encoding throughput, e.g. to check it keeps up with the link: python fec.py [group] [parity] [mss]
+    group = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    parity = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    mss = int(sys.argv[3]) if len(sys.argv) > 3 else 1000
+    groups = [[os.urandom(mss) for _ in range(group)] for _ in range(100)]
+    rounds = 20
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for segments in groups:
+            encode(segments, parity)
+    elapsed = time.perf_counter() - start
+    name = "encode (NumPy)" if numpy is not None else "encode"
+    print(f"{name:>16}: {rounds * len(groups) * group * mss / elapsed / 1e6:10,.1f} MB/s of data")
+
+    # Every single loss per parity segment is rebuilt
+    segments = groups[0][:-1] + [groups[0][-1][:mss // 3]]
+    code = Code(group, parity, FIRST + len(segments))
+    for lost in range(len(segments)):
+        decoder = Decoder(group, parity, code.end, lambda seq: len(segments[seq - FIRST]))
+        for seq, segment in enumerate(segments, FIRST):
+            if seq != FIRST + lost:
+                decoder.add(seq, segment)
+        rebuilt = []
+        for j, data in enumerate(encode(segments, parity)):
+            rebuilt += decoder.add_parity(FIRST + j, data)
+        assert rebuilt == [(FIRST + lost, segments[lost])], lost
+    print(f"{'decode':>16}: every single loss rebuilt")
@@ -0,0 +1,186 @@
+# metrics.py - Per-transfer counters, histograms and an optional event trace
+#
+# Per-packet output is gated on LEVEL and the trace on Metrics.trace being set,
+# so when both are off the hot path pays a single comparison.
+import bisect
+import collections
+import json
+import timer
+
+
+# Output levels, set from the command line with -v
+QUIET = 0       # Nothing but errors
+SUMMARY = 1     # The end-of-transfer summary
+PACKETS = 2     # Every packet sent and acknowledged
+LEVEL = SUMMARY
+
+TRACE_SIZE = 1 << 16    # Events kept by the trace ring buffer
+
+RTT_BOUNDS = [0.0001 * 2 ** i for i in range(18)]       # Seconds, 0.1 ms to 13 s
+GOODPUT_BOUNDS = [0.01 * 2 ** i for i in range(16)]     # MB/s, 10 KB/s to 330 MB/s
+WINDOW_BOUNDS = [2 ** i for i in range(12)]             # Packets in flight, 1 to 2048
+
+
+class Histogram(object):
+    """
+    Fixed-bucket histogram: constant memory however many values it records.
+
+    Attributes:
+        bounds (list): Inclusive upper bound of each bucket, ascending; a last bucket holds larger values.
+        buckets (list): Number of values in each bucket.
+    """
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    # Records one value
+    def record(self, value):
+        self.buckets[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    # Adds the values recorded by another histogram with the same bounds
+    def merge(self, other):
+        self.buckets = [mine + theirs for mine, theirs in zip(self.buckets, other.buckets)]
+        self.count += other.count
+        self.total += other.total
+        for value in (other.min, other.max):
+            if value is not None:
+                self.min = value if self.min is None else min(self.min, value)
+                self.max = value if self.max is None else max(self.max, value)
+
+    # Gets an upper estimate of the p-th percentile (0 - 100): the bound of its bucket
+    def percentile(self, p):
+        if not self.count:
+            return None
+        rank = p / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if n and seen >= rank:
+                return min(self.bounds[i], self.max) if i < len(self.bounds) else self.max
+        return self.max
+
+    def summary(self):
+        return {"count": self.count,
+                "mean": self.total / self.count if self.count else None,
+                "min": self.min, "max": self.max,
+                "p50": self.percentile(50), "p90": self.percentile(90), "p99": self.percentile(99),
+                "buckets": [[bound, n] for bound, n in zip(self.bounds + [None], self.buckets) if n]}
+
+
+class Trace(object):
+    """
+    Ring buffer of the most recent protocol events.
+
+    Events are (time, event, seq, ack, length) tuples; recording one is a deque append.
+    """
+
+    def __init__(self, size = TRACE_SIZE):
+        self.events = collections.deque(maxlen = size)
+
+    # Records one event
+    def record(self, event, seq = None, ack = None, length = None):
+        self.events.append((timer.now(), event, seq, ack, length))
+
+    # Writes the events to path: JSON lines for a .jsonl path, a tcpdump-like text log otherwise
+    def dump(self, path):
+        with open(path, "w") as file:
+            if path.endswith(".jsonl"):
+                for when, event, seq, ack, length in self.events:
+                    file.write(json.dumps({"time": when, "event": event, "seq": seq, "ack": ack, "length": length}) + "\n")
+            else:
+                start = self.events[0][0] if self.events else 0
+                for when, event, seq, ack, length in self.events:
+                    fields = [f"{when - start:12.6f}", f"{event:<16}"]
+                    if seq is not None:
+                        fields.append(f"seq {seq}")
+                    if ack is not None:
+                        fields.append(f"ack {ack}")
+                    if length is not None:
+                        fields.append(f"length {length}")
+                    file.write(" ".join(fields) + "\n")
+
+
+class Metrics(object):
+    """
+    Instrumentation of one transfer.
+
+    Attributes:
+        counters (collections.Counter): Event counts, e.g. transmitted, retransmissions, timeouts.
+        gauges (dict): Final values, e.g. the transfer time and the RTO estimator state.
+        rtt (Histogram): RTT samples in seconds.
+        goodput (Histogram): Goodput in MB/s over each GOODPUT_INTERVAL.
+        window (Histogram): Packets in flight, sampled at every burst.
+        trace (Trace): Event trace, None when tracing is off.
+    """
+    GOODPUT_INTERVAL = 0.1  # Seconds of delivery each goodput sample covers
+
+    def __init__(self, trace = False):
+        self.counters = collections.Counter()
+        self.gauges = {}
+        self.rtt = Histogram(RTT_BOUNDS)
+        self.goodput = Histogram(GOODPUT_BOUNDS)
+        self.window = Histogram(WINDOW_BOUNDS)
+        self.trace = Trace() if trace else None
+        self.start = timer.now()
+        self._interval_start = self.start
+        self._interval_bytes = 0
+
+    # Counts bytes acknowledged by the receiver and samples the goodput every GOODPUT_INTERVAL
+    def delivered(self, length):
+        self.counters["bytes"] += length
+        self._interval_bytes += length
+        now = timer.now()
+        if now - self._interval_start >= self.GOODPUT_INTERVAL:
+            self.goodput.record(self._interval_bytes / (now - self._interval_start) / 1e6)
+            self._interval_start = now
+            self._interval_bytes = 0
+
+    # Adds the counters, histograms and trace of another transfer, e.g. a parallel flow; its gauges replace these
+    def merge(self, other):
+        self.counters.update(other.counters)
+        self.gauges.update(other.gauges)
+        self.rtt.merge(other.rtt)
+        self.goodput.merge(other.goodput)
+        self.window.merge(other.window)
+        if self.trace is not None and other.trace is not None:
+            events = sorted(list(self.trace.events) + list(other.trace.events), key = lambda event: event[0])
+            self.trace.events = collections.deque(events, maxlen = self.trace.events.maxlen)
+
+    def summary(self):
+        return {"counters": dict(self.counters), "gauges": self.gauges,
+                "rtt": self.rtt.summary(), "goodput": self.goodput.summary(), "window": self.window.summary()}
+
+    # Prints the counters, gauges and histogram statistics
+    def print_summary(self):
+        for name, value in sorted(self.counters.items()):
+            print(f"{name}: {value}")
+        for name, value in self.gauges.items():
+            print(f"{name}: {value}")
+        for name, histogram in (("rtt", self.rtt), ("goodput", self.goodput), ("window", self.window)):
+            if histogram.count:
+                print(f"{name}: mean {histogram.total / histogram.count:.6g} min {histogram.min:.6g} "
+                      f"p50 {histogram.percentile(50):.6g} p90 {histogram.percentile(90):.6g} "
+                      f"p99 {histogram.percentile(99):.6g} max {histogram.max:.6g} ({histogram.count} samples)")
+
+    # Writes the summary to path as JSON
+    def dump(self, path):
+        with open(path, "w") as file:
+            json.dump(self.summary(), file, indent = 2)
+
+
+# Applies the -v, -trace and -metrics command-line options; returns (trace path, metrics path)
+def configure(args):
+    global LEVEL
+    LEVEL = int(args.get('-v', LEVEL))
+    return args.get('-trace'), args.get('-metrics')
@@ -1,20 +1,83 @@
 # packet.py - Packet-related functions
+#
+# Fixed binary header, network byte order, followed by the payload:
+#   version (1) | flags (1) | length (2) | seq (4) | ack (4) | window (4) | checksum (4)
+# The window is the number of packets the receiver can accept, advertised in ACKs.
+# A SACK's seq is the receiver's next expected packet and its payload a bitmap of the packets held beyond it.
+# The checksum covers the header fields before it and the payload.
+# seq and ack are sent modulo seqnum.SPACE; readers unwrap them with seqnum.unwrap.
+import struct
+import integrity
+import seqnum
+
+VERSION = 2
+
+# Flags
+SYN = 0x01  # Initialization, the payload describes the transfer
+FIN = 0x02  # The sender is done
+ACK = 0x04  # The ack field is valid
+NAK = 0x08  # Negative acknowledgement
+SACK = 0x10 # The payload lists the packets received beyond the cumulative ACK
+FEC = 0x20  # Parity segment, seq being the first data segment it covers
+DEDUP = 0x40    # Chunk manifest, seq numbering the manifest packets of a transfer
+
+HEADER = struct.Struct("!BBHIIII")
+HEADER_SIZE = HEADER.size
+_CHECKSUMMED = HEADER_SIZE - 4     # Bytes of the header covered by the checksum
 
 # Creates a packet from a sequence number and byte data
-def make(seq_num, checksum, data = b''):
-    seq_bytes = seq_num.to_bytes(4, byteorder = 'little', signed = True)
-    return seq_bytes + checksum + data
+def make(seq_num, data = b'', flags = 0, ack_num = 0, window = 0):
+    buffer = bytearray(HEADER_SIZE + len(data))
+    make_into(buffer, seq_num, data, flags, ack_num, window)
+    return bytes(buffer)
+
+# Packs a packet into a preallocated buffer and returns its length
+def make_into(buffer, seq_num, data = b'', flags = 0, ack_num = 0, window = 0):
+    length = len(data)
+    HEADER.pack_into(buffer, 0, VERSION, flags, length, seqnum.wrap(seq_num), seqnum.wrap(ack_num), window, 0)
+    buffer[HEADER_SIZE:HEADER_SIZE + length] = data
+    checksum = integrity.packet_checksum(memoryview(buffer)[:HEADER_SIZE + length], _CHECKSUMMED)
+    struct.pack_into("!I", buffer, _CHECKSUMMED, checksum)
+    return HEADER_SIZE + length
 
 # Creates an empty packet
 def make_empty():
     return b''
 
-# Extracts sequence number and data from a non-empty packet
+# Extracts sequence number, ack number, flags, advertised window and a zero-copy view of the payload from a non-empty packet
 def extract(packet):
-    seq_num = int.from_bytes(packet[0:4], byteorder = 'little', signed = True)
-    if packet[4:9] == b'FIRST':
-        checksum = packet[4:9]
-        return seq_num, checksum, packet[9:]
-    
-    checksum = packet[4:14] # TODO: Originally 4:12, changed it to 4:14 since 1000 is max 10 bits in binary
-    return seq_num, checksum, packet[14:]
+    _, flags, length, seq_num, ack_num, window, _ = HEADER.unpack_from(packet)
+    return seq_num, ack_num, flags, window, memoryview(packet)[HEADER_SIZE:HEADER_SIZE + length]
+
+# Encodes the sequence numbers received beyond base, the receiver's next expected packet,
+# as a bitmap whose bit i (least significant first) stands for packet base + 1 + i
+# Built in a bytearray, so each bit costs the same however large the window
+def make_sack(base, received):
+    if not received:
+        return b''
+    bitmap = bytearray(((max(received) - base - 1) >> 3) + 1)
+    for seq in received:
+        k = seq - base - 1
+        bitmap[k >> 3] |= 1 << (k & 7)
+    return bytes(bitmap)
+
+# Offsets of the bits set in each byte value, least significant first
+_BITS = [tuple(k for k in range(8) if value >> k & 1) for value in range(256)]
+
+# Decodes a bitmap made by make_sack into the sequence numbers it holds, ascending
+def extract_sack(base, bitmap):
+    received = []
+    for i, byte in enumerate(bitmap):
+        if byte:
+            first = base + 1 + (i << 3)
+            received.extend(first + k for k in _BITS[byte])
+    return received
+
+# Determines whether a packet is complete, of this version and not corrupted
+def verify(packet):
+    if len(packet) < HEADER_SIZE:
+        return False
+    version, _, length, _, _, _, checksum = HEADER.unpack_from(packet)
+    if version != VERSION or HEADER_SIZE + length != len(packet):
+        return False
+    return integrity.packet_intact(packet, _CHECKSUMMED, checksum)
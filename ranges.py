@@ -0,0 +1,51 @@
+# ranges.py - Sets of byte ranges [start, end), kept sorted and merged
+
+# Adds [start, end) to a sorted list of disjoint ranges, merging it with the ranges it touches
+def add(ranges, start, end):
+    if start >= end:
+        return
+    i = 0
+    while i < len(ranges) and ranges[i][1] < start:
+        i += 1
+    j = i
+    while j < len(ranges) and ranges[j][0] <= end:
+        start = min(start, ranges[j][0])
+        end = max(end, ranges[j][1])
+        j += 1
+    ranges[i:j] = [[start, end]]
+
+# Gets the ranges of [0, size) that are not covered
+def missing(ranges, size):
+    holes = []
+    position = 0
+    for start, end in ranges:
+        if start > position:
+            holes.append([position, min(start, size)])
+        position = max(position, end)
+    if position < size:
+        holes.append([position, size])
+    return holes
+
+# Determines whether [start, end) is covered
+def covers(ranges, start, end):
+    return any(first <= start and end <= last for first, last in ranges)
+
+# Splits ranges into at least parts pieces of similar size, cut at multiples of align bytes from each range's start
+def split(ranges, parts, align = 1):
+    total = sum(end - start for start, end in ranges)
+    piece = max(align, -(-total // parts // align) * align)
+    pieces = []
+    for start, end in ranges:
+        while end - start > piece:
+            pieces.append([start, start + piece])
+            start += piece
+        pieces.append([start, end])
+    return pieces
+
+# Encodes ranges as "start-end,start-end", at most limit of them
+def encode(ranges, limit = None):
+    return ",".join(f"{start}-{end}" for start, end in ranges[:limit])
+
+# Decodes ranges encoded by encode
+def decode(text):
+    return [[int(value) for value in item.split("-")] for item in text.split(",") if item]
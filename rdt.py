@@ -0,0 +1,88 @@
+# rdt.py - Programmatic API: upload files and serve uploads from Python code, without the command line
+#
+# Each upload (client.Connection) and each server (server.Server) carries its own settings,
+# so any number of them can run in one process. What describes the simulated path rather than
+# one transfer stays process-wide: the checksum (integrity.MODE), the channel impairments
+# (udt.CHANNEL, see udt.configure) and the verbosity (metrics.LEVEL).
+#
+# Protocols are strategies: a sender in client.SENDERS and a receiver in server.RECEIVERS,
+# under the same protocol number.
+import filecmp
+import os
+import sys
+import tempfile
+import time
+
+import client
+import metrics
+import server
+
+Connection = client.Connection
+Server = server.Server
+SENDERS = client.SENDERS
+RECEIVERS = server.RECEIVERS
+
+
+def send_file(file_path, port, protocol, window_size, **options):
+    """
+    Uploads a file, until the server has all of it and has checked it against the file's digest.
+
+    Parameters:
+        file_path (str): Path of the file to upload.
+        port (int): The server's port.
+        protocol (int): Key of the sender in SENDERS, the same as the server's.
+        window_size (int): Largest number of packets in flight.
+        options: Other settings of client.Connection, e.g. host, mss, flows, codec, dedup or fec_group and fec_parity.
+
+    Returns:
+        metrics.Metrics: Metrics of the transfer.
+
+    Raises:
+        ValueError: If a setting is invalid or the server cannot take it.
+        ConnectionError: If the server stops answering, the transfer makes no progress or the server's copy does not match.
+    """
+    return client.upload(client.Connection(file_path, port, protocol, window_size, **options))
+
+
+def serve(port, protocol, window_size, **options):
+    """
+    Starts a server on a thread of its own.
+
+    Parameters:
+        port (int): Port to listen on, 0 for any free one (see server_address).
+        protocol (int): Key of the receiver in RECEIVERS.
+        window_size (int): Receive window of every session, in packets.
+        options: Other settings of server.Server, e.g. host, mss, directory or fsync.
+
+    Returns:
+        server.Server: The running server; stop() stops it once its files are written.
+
+    Raises:
+        ValueError: If a setting is invalid.
+        OSError: If the port cannot be bound.
+    """
+    running = server.Server(port, protocol, window_size, **options)
+    running.start()
+    return running
+
+
+if __name__ == "__main__":
+    # Strategies side by side in one process: python rdt.py [file] [window_size]
+    file_path = os.path.join(client.CACHE, sys.argv[1] if len(sys.argv) > 1 else "video.mp4")
+    window_size = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    metrics.LEVEL = metrics.QUIET
+    size = os.path.getsize(file_path)
+
+    for protocol in sorted(SENDERS.keys() & RECEIVERS.keys()):
+        with tempfile.TemporaryDirectory() as directory:
+            running = serve(0, protocol, window_size, directory = directory, index_path = os.path.join(directory, server.INDEX))
+            start = time.perf_counter()
+            try:
+                stats = send_file(file_path, running.server_address[1], protocol, window_size)
+            finally:
+                running.stop()
+            elapsed = time.perf_counter() - start
+            received = [os.path.join(directory, name) for name in os.listdir(directory) if not name.endswith((".json", ".digest"))]
+            ok = len(received) == 1 and filecmp.cmp(received[0], file_path, shallow = False)
+            print(f"protocol {protocol}: {size / elapsed / 1e6:8.3f} MB/s, {stats.counters['retransmissions']:5d} retransmissions, "
+                  f"{'ok' if ok else 'MISMATCH'}")
@@ -1,72 +1,119 @@
 '''
-Unreliable medium: Probably 50%
-Window Size: 4
-Total number of transmitted packets:  724
-Number of retransmitted packets:  292
-Time taken to complete file transfer:  74.54184317588806
-Number of timeouts:  73
-
-Window Size: 8
-Total number of transmitted packets:  1117
-Number of retransmitted packets:  685
-Time taken to complete file transfer:  88.23038840293884
-Number of timeouts:  86
-
-Window Size: 12
-Total number of transmitted packets:  1525
-Number of retransmitted packets:  1093
-Time taken to complete file transfer:  95.04869055747986
-Number of timeouts:  92
-
-Window Size: 16
-Total number of transmitted packets:  1980
-Number of retransmitted packets:  1548
-Time taken to complete file transfer:  101.811678647995
-Number of timeouts:  98
-
-Window Size: 24
-Total number of transmitted packets:  3000
-Number of retransmitted packets:  2568
-Time taken to complete file transfer:  115.61076951026917
-Number of timeouts:  110
+Plots the results written by benchmark.py.
+
+Each case (protocol, congestion control, FEC, window size, MSS, loss rate, file)
+becomes one line over the window size, or over the MSS: the mean of its seeds
+with a 95% confidence interval. Failed runs are left out.
+
+Usage:
+    python report.py [results.csv]
 '''
+import csv
+import statistics
+import sys
 import matplotlib.pyplot as plt
 
 WINDOW_SIZE = "Window Size"
+MSS = "MSS (bytes)"
+PROTOCOLS = {0: "SnW", 1: "GBN", 2: "SR"}
+CASE = ("protocol", "cc", "fec", "window_size", "mss", "loss", "file")    # Fields that identify a case
+
+# Two-sided 95% Student's t critical values by degrees of freedom, 1.96 beyond the table
+T_95 = {1: 12.706, 2: 4.303, 3: 3.182, 4: 2.776, 5: 2.571, 6: 2.447, 7: 2.365, 8: 2.306, 9: 2.262,
+        10: 2.228, 15: 2.131, 20: 2.086, 30: 2.042}
+
+
+def load(path):
+    """
+    Reads the successful runs of a benchmark CSV file.
+
+    Parameters:
+        path (str): Path of the CSV file.
+
+    Returns:
+        list: Result rows with numeric fields converted.
+    """
+    rows = []
+    with open(path, newline = "") as file:
+        for row in csv.DictReader(file):
+            if row["ok"] != "True":
+                continue
+            for field in ("protocol", "window_size", "mss", "seed", "bytes", "transmitted", "retransmissions"):
+                row[field] = int(row[field])
+            for field in ("loss", "time", "goodput"):
+                row[field] = float(row[field])
+            row["timeouts"] = int(row["timeouts"]) if row["timeouts"] else 0
+            row["fec"] = row.get("fec") or "none"   # Results from before FEC
+            rows.append(row)
+    return rows
+
+
+def confidence(values):
+    """
+    Computes the mean and the half-width of its 95% confidence interval.
+
+    Parameters:
+        values (list): Measurements of one case.
+
+    Returns:
+        tuple: (mean, half-width); the half-width is 0 for a single measurement.
+    """
+    mean = statistics.mean(values)
+    if len(values) < 2:
+        return mean, 0
+    df = len(values) - 1
+    t = T_95.get(df) or next((T_95[k] for k in sorted(T_95) if k >= df), 1.96)
+    return mean, t * statistics.stdev(values) / len(values) ** 0.5
+
+
+def plot(rows, field, label, title, x = "window_size", xlabel = WINDOW_SIZE):
+    """
+    Plots one measurement against the window size (or another parameter), one line per case.
+
+    Parameters:
+        rows (list): Result rows.
+        field (str): Result field to plot.
+        label (str): Y-axis label.
+        title (str): Figure title.
+        x (str): Parameter on the X-axis, one of CASE.
+        xlabel (str): X-axis label.
+    """
+    cases = {}
+    for row in rows:
+        case = tuple((name, row[name]) for name in CASE if name != x)
+        cases.setdefault(case, {}).setdefault(row[x], []).append(row[field])
+
+    plt.figure(figsize=(10, 5))
+    for case, by_x in sorted(cases.items()):
+        values = sorted(by_x)
+        means, errors = zip(*(confidence(by_x[value]) for value in values))
+        fields = dict(case)
+        if "protocol" in fields:
+            fields["protocol"] = PROTOCOLS.get(fields["protocol"], fields["protocol"])
+        plt.errorbar(values, means, yerr=errors, marker='o', linestyle='-', capsize=4,
+                     label=" ".join(f"{name}={value}" for name, value in fields.items()))
+    plt.xlabel(xlabel)
+    plt.ylabel(label)
+    plt.title(title)
+    plt.grid(True)
+    plt.legend()
+    plt.show()
+
+
+if __name__ == "__main__":
+    rows = load(sys.argv[1] if len(sys.argv) > 1 else "results.csv")
+    if not rows:
+        print("Error: No successful runs to plot.")
+        sys.exit(1)
 
-# a. Window size (N) vs. time taken to complete file transfer
-window_size = [4, 8, 12, 16, 24]      # X-Axis: window size
-transmission_times = [74, 88, 95, 101, 115]  # Y-Axis: transmission time
-
-# Creating the first figure and plot (a. Transmission Time)
-plt.figure(figsize=(10, 5))
-plt.plot(window_size, transmission_times, marker='o', color='blue', linestyle='-')
-plt.xlabel(WINDOW_SIZE)
-plt.ylabel("Transmission Time")
-plt.title("GBN Measurements - Transmission Time")
-plt.grid(True)
-plt.show()
-
-# b. Window size (N) vs. # of retransmissions
-number_of_retransmissions = [292, 685, 1093, 1548, 2568]
-
-# Creating the second figure and plot (b. # of Retransmissions)
-plt.figure(figsize=(10, 5))
-plt.plot(window_size, number_of_retransmissions, marker='o', color='orange', linestyle='-')
-plt.xlabel(WINDOW_SIZE)
-plt.ylabel("# of Retransmissions")
-plt.title("GBN Measurements - Retransmissions")
-plt.grid(True)
-plt.show() 
-
-# c. Window size (N) vs. # of timeout
-number_of_timeouts = [73, 86, 92, 98, 110]
-
-# Creating the third figure and plot (c. # of Timeouts)
-plt.figure(figsize=(10, 5))
-plt.plot(window_size, number_of_timeouts, marker='o', color='green', linestyle='-')
-plt.xlabel(WINDOW_SIZE)
-plt.ylabel("# of Timeout")
-plt.title("GBN Measurements - Timeouts")
-plt.grid(True)
-plt.show() 
+    # a. Window size (N) vs. goodput
+    plot(rows, "goodput", "Goodput (MB/s)", "Measurements - Goodput")
+    # b. Window size (N) vs. time taken to complete file transfer
+    plot(rows, "time", "Transmission Time (s)", "Measurements - Transmission Time")
+    # c. Window size (N) vs. # of retransmissions
+    plot(rows, "retransmissions", "# of Retransmissions", "Measurements - Retransmissions")
+    # d. Window size (N) vs. # of timeouts
+    plot(rows, "timeouts", "# of Timeouts", "Measurements - Timeouts")
+    # e. MSS vs. goodput, when several were run
+    if len({row["mss"] for row in rows}) > 1:
+        plot(rows, "goodput", "Goodput (MB/s)", "Measurements - Goodput by MSS", x = "mss", xlabel = MSS)
@@ -0,0 +1,52 @@
+# rto.py - Adaptive retransmission timeout (RFC 6298)
+
+class RTOEstimator(object):
+    ALPHA = 1 / 8       # Gain of the smoothed RTT
+    BETA = 1 / 4        # Gain of the RTT variance
+    K = 4               # Variance multiplier
+    GRANULARITY = 0.001 # Clock granularity in seconds
+
+    def __init__(self, initial_rto = 1, min_rto = 0.2, max_rto = 60):
+        self.srtt = None
+        self.rttvar = None
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+        self.samples = 0
+        self.backoffs = 0
+        self._rto = self._clamp(initial_rto)
+        self._backoff = 1   # Multiplier applied by consecutive timeouts
+
+    def _clamp(self, value):
+        return min(self.max_rto, max(self.min_rto, value))
+
+    # Updates the estimate with an RTT measured on a packet that was never retransmitted (Karn's rule)
+    def sample(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - self.BETA) * self.rttvar + self.BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - self.ALPHA) * self.srtt + self.ALPHA * rtt
+        self._rto = self._clamp(self.srtt + max(self.GRANULARITY, self.K * self.rttvar))
+        self._backoff = 1
+        self.samples += 1
+
+    # Doubles the timeout after a retransmission timer expired
+    def backoff(self):
+        if self._rto * self._backoff < self.max_rto:
+            self._backoff *= 2
+        self.backoffs += 1
+
+    # Clears the backoff once an ACK for new data shows the path works again,
+    # even if Karn's rule gave no RTT sample
+    def acked(self):
+        self._backoff = 1
+
+    # Gets the current retransmission timeout
+    def rto(self):
+        return self._clamp(self._rto * self._backoff)
+
+    # Gets the estimator state, for the transfer metrics
+    def summary(self):
+        return {"srtt": self.srtt, "rttvar": self.rttvar, "rto": self.rto(),
+                "rtt_samples": self.samples, "backoffs": self.backoffs}
@@ -0,0 +1,83 @@
+# segments.py - Lazily read, memory-bounded file segmentation
+import os
+
+
+class SegmentSource(object):
+    """
+    Sequence of the segments of a file, or of a range of it, read on demand.
+
+    Segment 0 is the initialization string, segment i > 0 holds bytes
+    [offset + (i - 1) * mss, offset + i * mss) of the file. Segments are read into a reusable
+    buffer when first requested and kept only until release() is called, so
+    memory depends on the window size rather than on the file size.
+    """
+
+    def __init__(self, file_path, mss, header, offset = 0, length = None):
+        """
+        Opens the file to segment.
+
+        Parameters:
+            file_path (str): Path of the file to send.
+            mss (int): Maximum segment size in bytes.
+            header (str): Initialization string sent as segment 0.
+            offset (int): First byte of the range to send.
+            length (int): Bytes of the range to send, up to the end of the file by default.
+        """
+        self._file = open(file_path, "rb", buffering=0)
+        self._offset = offset
+        self._size = os.fstat(self._file.fileno()).st_size - offset if length is None else length
+        self._mss = mss
+        self._buffer = bytearray(mss)
+        self._view = memoryview(self._buffer)
+        self._position = None
+        self._segments = {}     # Resident segments, keyed by index
+        self._released = 0      # Segments before this index were released
+        self.header = header
+
+    # Number of data segments in the file
+    @property
+    def data_segments(self):
+        return (self._size + self._mss - 1) // self._mss
+
+    def __len__(self):
+        return self.data_segments + 1
+
+    def __getitem__(self, i):
+        if i == 0:
+            return self.header
+        if not 0 < i < len(self):
+            raise IndexError(i)
+
+        segment = self._segments.get(i)
+        if segment is None:
+            offset = self._offset + (i - 1) * self._mss
+            if offset != self._position:
+                self._file.seek(offset)
+            n = self._file.readinto(self._view[:self.length(i)])
+            self._position = offset + n
+            segment = self._segments[i] = bytes(self._view[:n])
+        return segment
+
+    # Length in bytes of data segment i > 0, without reading it
+    def length(self, i):
+        return min(self._mss, self._size - (i - 1) * self._mss)
+
+    # Drops every resident segment before index upto, e.g. once they are ACK'ed
+    # Only the indices released since the last call are looked up, so each costs one pop in all
+    def release(self, upto):
+        for i in range(self._released, upto):
+            self._segments.pop(i, None)
+        self._released = max(self._released, upto)
+
+    # Number of segments currently held in memory
+    def resident(self):
+        return len(self._segments)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,82 @@
+# seqnum.py - Sequence-number arithmetic modulo the space of the header's 32-bit fields
+#
+# Both ends count packets with unbounded integers and only put them on the wire modulo
+# the sequence space. A number read off the wire is unwrapped to the integer nearest a
+# reference the reader already knows, e.g. its send or receive base, which recovers it
+# as long as the two are less than half the space apart (serial number arithmetic,
+# RFC 1982). Windows must therefore stay under HALF packets.
+import random
+import sys
+import time
+
+BITS = 32
+SPACE = 1 << BITS   # Sequence numbers of the seq and ack header fields
+HALF = SPACE >> 1   # Largest distance at which two sequence numbers still compare
+ALTERNATING = 2     # Sequence space of Stop-and-Wait, the alternating bit
+
+
+# Reduces a sequence number to the space, as sent on the wire
+def wrap(seq, space = SPACE):
+    return seq % space
+
+# Adds n to a wire sequence number, wrapping around the space
+def add(seq, n, space = SPACE):
+    return (seq + n) % space
+
+# Gets the signed distance from wire sequence number b to a, in [-space / 2, space / 2)
+def diff(a, b, space = SPACE):
+    return (a - b + space // 2) % space - space // 2
+
+# Determines whether wire sequence number a comes before b
+def before(a, b, space = SPACE):
+    return diff(a, b, space) < 0
+
+# Gets the unbounded sequence number nearest reference that wire sequence number seq stands for
+def unwrap(seq, reference, space = SPACE):
+    return reference + diff(seq, reference % space, space)
+
+# Determines whether wire sequence number seq falls in the window of size packets starting at base
+def in_window(seq, base, size, space = SPACE):
+    return 0 <= diff(seq, base, space) < size
+
+
+if __name__ == "__main__":
+    # Stress: python seqnum.py [segments] [window]
+    # A Selective Repeat exchange across the wraparound, heavily reordered, tracked
+    # both on the wire and with unbounded integers, which must agree on every segment
+    segments = int(sys.argv[1]) if len(sys.argv) > 1 else 2_000_000
+    window = int(sys.argv[2]) if len(sys.argv) > 2 else 4096
+    rng = random.Random(0)
+    first = SPACE - segments // 2       # The wraparound falls midway
+    send_base = next_seq = rcv_base = first
+    held = set()
+    in_flight = []
+    delivered = 0
+
+    start = time.perf_counter()
+    while rcv_base < first + segments:
+        while next_seq < min(send_base + window, first + segments):
+            in_flight.append(next_seq)
+            next_seq += 1
+        # Deliver a random half of what is in flight, out of order
+        rng.shuffle(in_flight)
+        arriving, in_flight = in_flight[:len(in_flight) // 2 + 1], in_flight[len(in_flight) // 2 + 1:]
+        for true_seq in arriving:
+            seq = unwrap(wrap(true_seq), rcv_base)
+            assert seq == true_seq
+            assert in_window(wrap(seq), wrap(rcv_base), window) == (rcv_base <= seq < rcv_base + window)
+            if rcv_base <= seq < rcv_base + window:
+                held.add(seq)
+            while rcv_base in held:
+                held.remove(rcv_base)
+                rcv_base += 1
+                delivered += 1
+            # The ACK carries the cumulative next expected packet, unwrapped at the sender
+            ack = unwrap(wrap(rcv_base), send_base)
+            assert ack == rcv_base and not before(wrap(ack), wrap(send_base))
+            send_base = max(send_base, ack)
+        in_flight = [seq for seq in in_flight if seq >= rcv_base]
+    elapsed = time.perf_counter() - start
+
+    assert delivered == segments and add(wrap(first), segments) == wrap(first + segments)
+    print(f"{segments:,} segments across the wraparound, window {window}: {segments / elapsed:,.0f} segments/s")
@@ -18,137 +18,974 @@ Stop-and-Wait ARQ:
         - Send ACK
     - else: send NAK
 Note: Timer would be for sender side.
+
+Go-Back-N ARQ:
+- Deliver only the packet at rcv_base
+- ACKs are cumulative: always ACK rcv_base - 1, so out-of-order packets
+  produce duplicate ACKs that trigger the sender's fast retransmit
+
+Selective Repeat ARQ:
+- Packet within [rcv_base, rcv_base + N - 1]
+    - Send ACK for that packet, buffer it if out of order
+    - If it is rcv_base, deliver it and every buffered packet after it
+- Packet within [rcv_base - N, rcv_base - 1]: send ACK again
 '''
-import socket
+import json
+import os
+import signal
 import sys
+import threading
 import udt, packet
+import timer
+import eventloop
+import integrity
+import metrics
+import ranges
+import fec
+import compress
+import chunks
+import digest
+import seqnum
+import writer
 
 
 # Constants
 HOST = "127.0.0.1"
 CACHE = "ServerCache/"
-MSS = 1000
+MSS = udt.MAX_DATAGRAM - packet.HEADER_SIZE    # Largest MSS granted to a client
+WRITE_BUFFER = 1 << 16  # Bytes buffered per session before hitting the disk
+IDLE_TIMEOUT = 30       # Seconds of silence before a session is reaped
+REAP_INTERVAL = 5       # Seconds between idle session sweeps
+SAVE_INTERVAL = 1       # Seconds between saves of a transfer's received ranges
+MAX_RANGES = 64         # Missing ranges reported per handshake, to keep the answer in one datagram; the total missing is reported too
+INDEX = "ServerChunks.json" # Chunk index, next to ServerCache/
+INDEX_CAPACITY = 1 << 16    # Chunks indexed, the least recently used evicted first
+WRITE_QUEUE = 1 << 24   # Bytes queued for the writer thread before the advertised window closes
+
+
+class Transfer:
+    """
+    A file being received, possibly over several flows and across restarts.
+
+    The file is written at offsets by the write-behind thread, under a temporary
+    .part name. The byte ranges written so far are saved next to it, in a .ranges
+    file, so that a restarted client can send just the missing ranges. The writer
+    thread also hashes the data as it writes it (digest.Digest). Once the client
+    ends the transfer with the digest of its file, the file is checked against it
+    and renamed after the transfer ID, or discarded if it does not match. A file the
+    writer thread failed to write is discarded at that check too. The digest a file
+    was verified against is kept next to it, in a .digest file, so that ending the
+    transfer again only succeeds with the same digest.
+
+    Attributes:
+        transfer_id (str): Identifier chosen by the client for the file.
+        size (int): Size of the complete file in bytes.
+        writer (writer.Writer): Write-behind thread the file is written by.
+        path (str): Final path of the file, only ever holding a verified file.
+        part (str): Path the file is written to until it is verified.
+        file_digest (str): Digest the file at path was verified against, None if there is none.
+        accepted (list): Byte ranges [start, end) queued for writing or written, sorted and merged.
+        received (list): Byte ranges [start, end) written so far, updated by the writer thread.
+        digest (digest.Digest): Digest of the data written, updated by the writer thread.
+        flows (int): Open sessions writing to the file.
+        closing (int): Descriptors of the file the writer thread has yet to close, and checks it has yet to make.
+        finished (bool): Whether the file was verified and renamed.
+        verifying (bool): Whether the writer thread is checking the file.
+        mismatched (bool): Whether the last check failed, until a flow opens the transfer again.
+        failed (OSError): The first error writing the file since it was last discarded, None if none.
+    """
+
+    def __init__(self, transfers, writer, directory, transfer_id, extension, size):
+        """
+        Initializes a Transfer object from the ranges saved by earlier runs, if any.
+
+        Parameters:
+            transfers (dict): Open transfers keyed by ID, which this one leaves once idle.
+            writer (writer.Writer): Write-behind thread the file is written by.
+            directory (str): Directory of the output file.
+            transfer_id (str): Identifier chosen by the client for the file.
+            extension (str): Extension of the file being uploaded.
+            size (int): Size of the complete file in bytes.
+        """
+        self.transfers = transfers
+        self.transfer_id = transfer_id
+        self.size = size
+        self.writer = writer
+        self.path = os.path.join(directory, f"{transfer_id}.{extension}")
+        self.part = self.path + ".part"
+        self.ranges_path = self.path + ".ranges"
+        self.digest_path = self.path + ".digest"
+        # Only a verified file has the final name, and its digest next to it
+        self.file_digest = self._load_digest()
+        self.finished = (self.file_digest is not None and not os.path.exists(self.part)
+                         and os.path.exists(self.path) and os.path.getsize(self.path) == size)
+        self.received = [[0, size]] if self.finished else self._load()
+        self.accepted = [list(byte_range) for byte_range in self.received]
+        self.digest = digest.Digest(size)
+        self.flows = 0
+        self.closing = 0
+        self.verifying = False
+        self.mismatched = False
+        self.failed = None
+        self.fd = None
+        self.saved = timer.now()
+        self.lock = threading.Lock()    # Guards received, closing and the .ranges file against the writer thread
+
+    def _load(self):
+        if not os.path.exists(self.part):
+            return []
+        try:
+            with open(self.ranges_path) as file:
+                state = json.load(file)
+            if state["size"] == self.size:
+                return state["received"]
+        except (OSError, ValueError, KeyError):
+            pass
+        return []
+
+    def _load_digest(self):
+        try:
+            with open(self.digest_path) as file:
+                return file.read().strip() or None
+        except OSError:
+            return None
+
+    def missing(self):
+        """
+        Gets the byte ranges not received yet, counting those still queued for writing.
+
+        Returns:
+            list: Missing ranges [start, end).
+        """
+        return ranges.missing(self.accepted, self.size)
+
+    def open(self):
+        """
+        Registers a flow, opening the output file for the first one unless the transfer is finished.
+        """
+        if self.fd is None and not self.finished:
+            self.fd = os.open(self.part, os.O_RDWR | os.O_CREAT, 0o644)
+            self.transfers[self.transfer_id] = self
+            self.save()
+        self.mismatched = False
+        self.flows += 1
+
+    def write(self, offset, data):
+        """
+        Queues data to be written at an offset of the file and records the range.
+
+        Parameters:
+            offset (int): Offset of the data in the file.
+            data (bytes): Data to write, not modified afterwards.
+        """
+        ranges.add(self.accepted, offset, offset + len(data))
+        self.writer.write(self.fd, offset, data, self._written)
+
+    # Writer thread: hashes and records written data, saving the ranges every SAVE_INTERVAL and on completion
+    def _written(self, offset, data, error):
+        if error is not None:
+            self._fail(error)
+            return
+        self.digest.update(offset, data)
+        with self.lock:
+            ranges.add(self.received, offset, offset + len(data))
+            if timer.now() - self.saved > SAVE_INTERVAL or not ranges.missing(self.received, self.size):
+                self._save()
+
+    def save(self):
+        """
+        Saves the written ranges, or removes them once the file is verified.
+        """
+        with self.lock:
+            self._save()
+
+    # The saved ranges only spare a resumed transfer some data, so failing to save them leaves the last ones
+    def _save(self):
+        self.saved = timer.now()
+        try:
+            if not self.finished:
+                with open(self.ranges_path + ".tmp", "w") as file:
+                    json.dump({"size": self.size, "received": self.received}, file)
+                os.replace(self.ranges_path + ".tmp", self.ranges_path)
+            elif os.path.exists(self.ranges_path):
+                os.remove(self.ranges_path)
+        except OSError:
+            pass
+
+    def release(self):
+        """
+        Unregisters a flow, closing the output file after the last one once its data is written.
+        """
+        self.flows -= 1
+        if self.flows == 0 and self.fd is not None:
+            with self.lock:
+                self.closing += 1
+            self.writer.close(self.fd, self._closed)
+            self.fd = None
+
+    # Writer thread: saves the ranges once the file is closed
+    def _closed(self, error):
+        if error is not None:
+            self._fail(error)
+        with self.lock:
+            self._save()
+            self.closing -= 1
+
+    def verify(self, expected, done):
+        """
+        Checks the file against the client's digest once everything queued is written,
+        renaming it to its final name if it matches and discarding it otherwise,
+        or if writing it failed. A finished file is checked against the digest it
+        was verified with, and discarded if the client's differs, e.g. because
+        another file was uploaded under the same transfer ID.
+
+        Parameters:
+            expected (str): Hexadecimal digest of the client's file.
+            done (function): Called with digest.OK or digest.MISMATCH, on the writer thread.
+        """
+        self.transfers[self.transfer_id] = self
+        self.verifying = True
+        with self.lock:
+            self.closing += 1
+        self.writer.call(lambda: self._verify(expected, done))
+
+    # Writer thread: records the first error writing the file, which is discarded at its check
+    def _fail(self, error):
+        with self.lock:
+            if self.failed is None:
+                self.failed = error
+                if metrics.LEVEL >= metrics.SUMMARY:
+                    print(f"Server: Writing {self.part} failed - {error}")
+
+    # Writer thread: reads back the blocks not hashed in order, then keeps or discards the file
+    def _verify(self, expected, done):
+        matches = False
+        try:
+            if self.finished:
+                matches = self.file_digest == expected
+            elif self.failed is None:
+                fd = os.open(self.part, os.O_RDONLY | os.O_CREAT, 0o644)
+                try:
+                    matches = self.digest.hexdigest(lambda offset, length: os.pread(fd, length, offset)) == expected
+                finally:
+                    os.close(fd)
+        except OSError as error:
+            self._fail(error)
+        with self.lock:
+            if matches and not self.finished:
+                try:
+                    with open(self.digest_path + ".tmp", "w") as file:
+                        file.write(expected)
+                    if os.path.exists(self.digest_path):
+                        os.remove(self.digest_path)
+                    os.replace(self.part, self.path)
+                    os.replace(self.digest_path + ".tmp", self.digest_path)
+                    self.file_digest = expected
+                    self.finished = True
+                except OSError:
+                    matches = False
+            if matches:
+                self._save()
+            else:
+                # A finished file gives way to the one the client is uploading under its transfer ID
+                paths = [self.part, self.ranges_path, self.digest_path + ".tmp"]
+                if self.finished:
+                    paths += [self.path, self.digest_path]
+                self.finished = False
+                self.file_digest = None
+                for path in paths:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                self.received = []
+                self.digest = digest.Digest(self.size)
+                self.failed = None
+            self.closing -= 1
+        done(digest.OK if matches else digest.MISMATCH)
+
+    def verified(self, verdict):
+        """
+        Ends a check; a file that did not match is to be sent again.
+
+        Parameters:
+            verdict (str): digest.OK or digest.MISMATCH.
+        """
+        self.verifying = False
+        if verdict == digest.MISMATCH:
+            self.mismatched = True
+            self.accepted = []
+
+    def idle(self):
+        """
+        Determines whether the transfer has no flow and nothing left to write, so it may leave transfers.
+        A transfer with every byte accepted but not checked yet is not idle: its digest of the
+        blocks written spares reading the whole file back when the client ends the transfer.
+
+        Returns:
+            bool: True if idle.
+        """
+        with self.lock:
+            return self.flows == 0 and self.closing == 0 and (self.finished or bool(self.missing()))
 
 
 class ClientState:
     """
-    Represents the state of a client.
+    Represents the state of a client: one flow sending one range of a transfer.
 
     Attributes:
         rcv_base (int): The expected sequence number for the next packet to be received.
         max_packets (int): The maximum number of packets transmitted by the client.
+        space (int): Sequence space of the client's packets on the wire.
+        transfer (Transfer): The file the flow belongs to.
+        mss (int): Maximum segment size negotiated with the client.
+        window_size (int): Receive window, in packets.
+        buffer (dict): Out-of-order packets held for Selective Repeat, keyed by sequence number.
+        fec (fec.Decoder): Rebuilds lost segments from the client's parity segments, None without FEC.
+        decompressor (compress.Decompressor): Decompresses the flow's stream, None for raw data.
+        encoded (int): Bytes of the flow's stream on the wire, compressed or not.
+        streamed (int): Bytes of the stream delivered so far.
+        start (int): File offset of the flow's range.
+        offset (int): File offset of the first byte delivered but not written yet.
+        end (int): File offset where the flow's range ends.
+        pending (bytearray): Data delivered in order, written once WRITE_BUFFER bytes or the whole range arrived.
+        last_active (float): Time the last packet was received from the client.
     """
 
-    def __init__(self, initial_seq, max_packets):
+    def __init__(self, initial_seq, max_packets, transfer, offset, length, mss, window_size, space, codec = "none", encoded = None):
         """
         Initializes a ClientState object.
 
         Parameters:
             initial_seq (int): The initial sequence number for the client.
             max_packets (int): The maximum number of packets transmitted by the client.
+            transfer (Transfer): The file the flow belongs to.
+            offset (int): File offset of the flow's range.
+            length (int): Bytes in the flow's range.
+            mss (int): Maximum segment size negotiated with the client.
+            window_size (int): Receive window, in packets.
+            space (int): Sequence space of the client's packets on the wire.
+            codec (str): Codec the range is compressed with, none for raw data.
+            encoded (int): Bytes of the compressed range, length for raw data.
         """
         self.rcv_base = initial_seq
         self.max_packets = max_packets
+        self.space = space
+        self.transfer = transfer
+        self.mss = mss
+        self.window_size = window_size
+        self.buffer = {}
+        self.fec = None
+        self.decompressor = None if codec == "none" else compress.Decompressor(codec)
+        self.encoded = length if encoded is None else encoded
+        self.streamed = 0
+        self.start = offset
+        self.offset = offset
+        self.end = offset + length
+        self.pending = bytearray()
+        self.last_active = timer.now()
+        transfer.open()
+
+    def advertised_window(self):
+        """
+        Gets the number of packets the session can accept, advertised in every ACK.
+
+        Returns:
+            int: Receive window minus the out-of-order packets held in the buffer,
+            at most the segments that fit in the write queue.
+        """
+        return max(0, min(self.window_size - len(self.buffer), self.transfer.writer.free() // self.mss))
+
+    def segment_length(self, seq):
+        """
+        Gets the length of a data segment of the flow's range.
+
+        Parameters:
+            seq (int): Sequence number of the segment, 1 for the first.
+
+        Returns:
+            int: Length of the segment in bytes.
+        """
+        return min(self.mss, self.encoded - (seq - 1) * self.mss)
+
+    def deliver(self, data):
+        """
+        Delivers the next in-order data of the flow, decompressing it first if the flow is compressed.
+
+        Parameters:
+            data (bytes): The delivered data.
+
+        Returns:
+            int: Number of bytes delivered, as sent on the wire.
+        """
+        length = len(data)
+        self.streamed += length
+        if self.decompressor is not None:
+            data = self.decompressor.decompress(data)
+            if self.streamed >= self.encoded:
+                data += self.decompressor.flush()
+        self.pending += data
+        del self.pending[self.end - self.offset:]   # Never past the range, whatever the stream holds
+        if len(self.pending) >= WRITE_BUFFER or self.offset + len(self.pending) >= self.end:
+            self.flush()
+        return length
+
+    def flush(self):
+        """
+        Queues the pending data for writing to the file.
+        """
+        if self.pending:
+            self.transfer.write(self.offset, self.pending)
+            self.offset += len(self.pending)
+            self.pending = bytearray()
+
+    def close(self):
+        """
+        Flushes the pending data and releases the transfer.
+        """
+        self.flush()
+        self.transfer.release()
+
+
+def send_ack(outbox, stats, addr, seq, ack, window, syn = None, sack = None, dedup = None, fin = None):
+    """
+    Queues an acknowledgement, sent with the others of the same batch.
+
+    Parameters:
+        outbox (dict): Acknowledgements waiting to be sent, keyed by address.
+        stats (metrics.Metrics): Server metrics, traced when enabled.
+        addr (tuple): The client's (host, port) tuple.
+        seq (int): The receiver's next expected sequence number.
+        ack (int): The acknowledged sequence number.
+        window (int): The receive window advertised to the client.
+        syn (bytes): Answer to a SYN (granted MSS, missing ranges, codecs and missing bytes), None otherwise.
+        sack (bytes): Bitmap of the packets held beyond seq, None for a cumulative acknowledgement.
+        dedup (bytes): Answer to a chunk manifest (bytes of its chunks held), None otherwise.
+        fin (bytes): Answer to the end of a transfer (a verdict of digest), None otherwise.
+    """
+    if syn is not None:
+        ackpkt = packet.make(seq, syn, packet.SYN | packet.ACK, ack, window)
+    elif fin is not None:
+        ackpkt = packet.make(seq, fin, packet.FIN | packet.ACK, ack, window)
+    elif dedup is not None:
+        ackpkt = packet.make(seq, dedup, packet.DEDUP | packet.ACK, ack, window)
+    elif sack is not None:
+        ackpkt = packet.make(seq, sack, packet.ACK | packet.SACK, ack, window)
+    else:
+        ackpkt = packet.make(seq, flags = packet.ACK, ack_num = ack, window = window)
+    outbox.setdefault(addr, []).append(ackpkt)
+    stats.counters["acks"] += 1
+    if metrics.LEVEL >= metrics.PACKETS:
+        print("Server: Ack sent - ", ack)
+    if stats.trace is not None:
+        stats.trace.record("ack", seq, ack)
+
+
+def parse_fields(data, count, numeric):
+    """
+    Splits the colon-separated fields of a control payload (SYN, DEDUP or FIN), checking them.
 
+    Parameters:
+        data (bytes): The payload, or its header line.
+        count (int): Number of fields the payload must have.
+        numeric (tuple): Positions of the fields that must be non-negative integers.
 
-def create_checksum(i, data):
+    Returns:
+        list: The fields, the numeric ones converted to int, or None if the payload is malformed.
     """
-    Creates a checksum for the given data.
+    try:
+        fields = str(data, "utf-8").split(":")
+    except UnicodeDecodeError:
+        return None
+    if len(fields) != count:
+        return None
+    for position in numeric:
+        if not (fields[position].isascii() and fields[position].isdigit()):
+            return None
+        fields[position] = int(fields[position])
+    return fields
+
+
+def deduplicate(transfer, index, manifest):
+    """
+    Copies the chunks of a manifest that the server already holds into a transfer,
+    and indexes the others at their place in it.
 
     Parameters:
-        i (int): Sequence number.
-        data (bytes): Data for which checksum is to be created.
+        transfer (Transfer): The file the manifest describes.
+        index (chunks.Index): Where the server holds each chunk.
+        manifest (bytes): chunks.ENTRY records of chunks of the file.
 
     Returns:
-        str: Computed checksum.
+        tuple: Bytes copied, and bytes of the manifest's chunks the transfer holds now,
+            which stays the same when a manifest is resent after a lost answer.
+    """
+    copied = held = 0
+    name = os.path.basename(transfer.path)
+    transfer.open()
+    try:
+        for offset, length, digest in chunks.ENTRY.iter_unpack(manifest):
+            if offset + length > transfer.size:
+                continue
+            if not ranges.covers(transfer.accepted, offset, offset + length):
+                data = index.read(digest)
+                if data is not None and len(data) == length:
+                    transfer.write(offset, data)
+                    copied += length
+            if ranges.covers(transfer.accepted, offset, offset + length):
+                held += length
+            index.add(digest, name, offset, length)
+    finally:
+        transfer.release()
+    return copied, held
+
+
+def receive_selective(server, outbox, client, seq, flags, data_rcvd, addr):
     """
+    Selective Repeat: buffers out-of-order packets and ACKs each one individually,
+    along with the next expected packet and a SACK bitmap of the buffered ones.
 
-    # Add sequence number
-    data = bytes([i]) + data
+    Parameters:
+        server (Server): The server the session belongs to.
+        outbox (dict): Acknowledgements waiting to be sent, keyed by address.
+        client (ClientState): The client's session.
+        seq (int): Sequence number of the packet, unwrapped.
+        flags (int): Flags of the packet.
+        data_rcvd (memoryview): Payload of the packet, only valid during the call.
+        addr (tuple): The client's (host, port) tuple.
+    """
+    stats = server.stats
+    window_size = client.window_size
+    # Parity segments rebuild a lost segment of their group, ACK'ed as if it had arrived
+    if flags & packet.FEC:
+        if client.fec is None:
+            return
+        stats.counters["parity"] += 1
+        rebuilt = client.fec.add_parity(seq, data_rcvd)
+    elif client.rcv_base <= seq < client.rcv_base + window_size:
+        if seq in client.buffer:
+            stats.counters["duplicates"] += 1
+        client.buffer[seq] = bytes(data_rcvd)   # The receive buffer is reused
+        rebuilt = client.fec.add(seq, client.buffer[seq]) if client.fec is not None else []
+    elif client.rcv_base - window_size <= seq < client.rcv_base:
+        stats.counters["duplicates"] += 1
+        rebuilt = []
+    else:
+        return
+
+    acked = [] if flags & packet.FEC else [seq]
+    for rebuilt_seq, data in rebuilt:
+        if client.rcv_base <= rebuilt_seq < client.rcv_base + window_size and rebuilt_seq not in client.buffer:
+            client.buffer[rebuilt_seq] = data
+            stats.counters["recovered"] += 1
+            acked.append(rebuilt_seq)
+    while client.rcv_base in client.buffer:
+        stats.counters["bytes"] += client.deliver(client.buffer.pop(client.rcv_base))
+        client.rcv_base += 1
+    if client.fec is not None:
+        client.fec.forget(client.rcv_base)
+
+    for ack in acked:
+        send_ack(outbox, stats, addr, client.rcv_base, ack, client.advertised_window(),
+                 sack = packet.make_sack(client.rcv_base, client.buffer))
+
+
+def receive_in_order(server, outbox, client, seq, flags, data_rcvd, addr):
+    """
+    Stop-and-Wait and Go-Back-N: delivers only the packet at rcv_base and ACKs
+    cumulatively, so out-of-order packets produce duplicate ACKs.
 
-    # Get sum of bits
-    data_sum = len(data)
-    bit_sum = bin(data_sum)[2:]
+    Parameters: as receive_selective.
+    """
+    # Deliver the data
+    if seq == client.rcv_base:
+        client.rcv_base += 1  # Update expected sequence number
+        server.stats.counters["bytes"] += client.deliver(data_rcvd)
+    else:
+        server.stats.counters["out_of_order"] += 1
 
-    # Pad to 10 bits
-    while len(bit_sum) < 10: 
-        bit_sum = '0' + bit_sum
+    # Send cumulative acknowledgement for the last packet delivered in order
+    send_ack(outbox, server.stats, addr, seqnum.wrap(client.rcv_base, client.space), seqnum.wrap(client.rcv_base - 1, client.space), client.advertised_window())
 
-    # Get Ones' Complement (Flip all the bits)
-    checksum = ''
-    for bit in bit_sum:
-        checksum += '1' if bit == '0' else '0'
 
-    return checksum
+# Receivers by protocol number, with the sequence space of their packets on the wire;
+# a receiver handles one data packet of a session and queues its acknowledgements
+RECEIVERS = {0: (receive_in_order, seqnum.ALTERNATING), 1: (receive_in_order, seqnum.SPACE), 2: (receive_selective, seqnum.SPACE)}
 
 
-def verify_checksum(i, checksum, data):
+class Server:
     """
-    Verifies the checksum of the received data.
+    Receives uploads on one UDP port with one protocol, until stopped.
 
-    Parameters:
-        i (int): Sequence number.
-        checksum (str): Received checksum.
-        data (bytes): Received data.
+    Holds everything its packet handlers need, so that several servers can run
+    in one process, each on its own thread.
 
-    Returns:
-        bool: True if the checksum is valid, False otherwise.
+    Attributes:
+        server_address (tuple): The (host, port) tuple the socket is bound to.
+        protocol (int): Key of the receiver in RECEIVERS (0 - SnW, 1 - GBN, 2 - SR).
+        window_size (int): Receive window of every session, in packets.
+        mss (int): Largest MSS granted to a client.
+        directory (str): Directory the files are written to.
+        clients (dict): Client states keyed by address.
+        transfers (dict): Files being received, shared by their flows, keyed by transfer ID.
+        index (chunks.Index): Where the server holds the chunks of the files it received.
+        writer (writer.Writer): Write-behind thread.
+        stats (metrics.Metrics): Server metrics, traced when enabled.
+        thread (threading.Thread): Thread run() runs on once start() is called, None otherwise.
     """
-    if checksum == b"DONE" or checksum == b"FIRST":
-        return True
 
-    received_checksum = create_checksum(i, data).encode("utf-8")
+    def __init__(self, port, protocol, window_size, host = HOST, mss = MSS, directory = CACHE, index_path = None,
+                 fsync = "none", sndbuf = None, rcvbuf = None, trace = False, loop = None):
+        """
+        Initializes a Server object and binds its socket.
 
-    return checksum == received_checksum
+        Parameters:
+            port (int): Port to listen on, 0 for any free one.
+            protocol (int): Key of the receiver in RECEIVERS.
+            window_size (int): Receive window of every session, in packets.
+            host (str): Address to listen on.
+            mss (int): Largest MSS granted to a client.
+            directory (str): Directory the files are written to.
+            index_path (str): Path of the chunk index, INDEX next to directory if None.
+            fsync (str): One of writer.FSYNC.
+            sndbuf (int): Socket send buffer size, the system default if None.
+            rcvbuf (int): Socket receive buffer size, the system default if None.
+            trace (bool): Whether to record an event trace.
+            loop (eventloop.EventLoop): Loop the server runs on, e.g. a sim.Network; a new one if None.
+
+        Raises:
+            ValueError: If a setting is invalid.
+            OSError: If the socket cannot be bound.
+        """
+        if protocol not in RECEIVERS:
+            raise ValueError(f"The protocol must be one of {', '.join(str(key) for key in RECEIVERS)}.")
+        if not 0 < window_size < seqnum.HALF:
+            raise ValueError(f"The window size must be between 1 and {seqnum.HALF - 1} packets.")
+        if fsync not in writer.FSYNC:
+            raise ValueError(f"fsync must be one of {', '.join(writer.FSYNC)}.")
+        if not 0 < mss <= udt.MAX_DATAGRAM - packet.HEADER_SIZE:
+            raise ValueError(f"MSS must be between 1 and {udt.MAX_DATAGRAM - packet.HEADER_SIZE} bytes.")
+
+        self.protocol = protocol
+        self.window_size = window_size
+        self.mss = mss
+        self.directory = directory
+        if index_path is None:
+            index_path = os.path.join(os.path.dirname(os.path.normpath(directory)), INDEX)
+
+        # Create a UDP socket and bind it to the port
+        self.sock = udt.open_socket()
+        udt.set_buffers(self.sock, sndbuf, rcvbuf)
+        self.sock.bind((host, port))
+        self.server_address = self.sock.getsockname()
+
+        self.clients = {}   # Store the states for multiple clients
+        self.transfers = {}
+        self.index = chunks.Index(index_path, directory, INDEX_CAPACITY)
+        self.writer = writer.Writer(WRITE_QUEUE, fsync)
+        self.stats = metrics.Metrics(trace = trace)
+        self.loop = eventloop.EventLoop() if loop is None else loop
+        self.thread = None
+        self._flush_handle = None
+
+    # Gets the transfer a client names, resuming it from an earlier run if it is not open
+    def transfer(self, transfer_id, extension, size):
+        return self.transfers.get(transfer_id) or Transfer(self.transfers, self.writer, self.directory, transfer_id, extension, size)
+
+    def receive(self, outbox, pkt, addr):
+        """
+        Handles one packet received from a client.
+
+        Parameters:
+            outbox (dict): Acknowledgements waiting to be sent, keyed by address.
+            pkt (memoryview): The received packet, only valid during the call.
+            addr (tuple): The client's (host, port) tuple.
+        """
+        stats = self.stats
+        clients = self.clients
+        stats.counters["received"] += 1
+        if not packet.verify(pkt):
+            stats.counters["corrupted"] += 1
+            return
+        seq, _, flags, _, data_rcvd = packet.extract(pkt)
+        if stats.trace is not None:
+            stats.trace.record("recv", seq, None, len(data_rcvd))
+
+        # End of a flow: close the client's session if "DONE" (FIN) packet received
+        # End of the transfer: a FIN carrying the file's extension, transfer ID, size and digest
+        if flags & packet.FIN:
+            if len(data_rcvd):
+                self.finish(outbox, seq, data_rcvd, addr)
+            elif addr in clients:
+                clients.pop(addr).close()
+            return
+
+        # Chunk manifest: receive file extension, transfer ID and file size, then the chunks of the file
+        # Fill the file with the chunks we already hold, so that the client only sends the rest
+        if flags & packet.DEDUP:
+            header, _, manifest = bytes(data_rcvd).partition(b"\n")
+            fields = parse_fields(header, 3, (2,))
+            if fields is None or not fields[0].isalnum() or not fields[1].isalnum() or len(manifest) % chunks.ENTRY.size:
+                stats.counters["malformed"] += 1
+                return
+            extension, transfer_id, size = fields
+            transfer = self.transfer(transfer_id, extension, size)
+            copied, held = deduplicate(transfer, self.index, manifest)
+            stats.counters["dedup_bytes"] += copied
+            send_ack(outbox, stats, addr, seq, seq, self.window_size, dedup = bytes(str(held), "utf-8"))
+            return
+
+        # First (SYN): receive file extension, packet count, proposed MSS, transfer ID, file size, the flow's range,
+        # its FEC group and parity segment counts (0 without FEC) and the codec and size of the range as sent
+        # Grant the smaller of the proposed MSS and ours and report the missing ranges, our codecs and the bytes missing in all,
+        # as only the first MAX_RANGES ranges are listed; a SYN before any data renegotiates
+        # A SYN with an empty range only asks for the missing ranges
+        if flags & packet.SYN:
+            fields = parse_fields(data_rcvd, 11, (1, 2, 4, 5, 6, 7, 8, 10))
+            if fields is None:
+                stats.counters["malformed"] += 1
+                return
+            extension, max_packets_transmitted, proposed_mss, transfer_id, size, offset, length, group, parity, codec, encoded = fields
+            if (not extension.isalnum() or not transfer_id.isalnum() or not proposed_mss or offset + length > size
+                    or (group and not 0 < parity <= group) or (codec != "none" and codec not in compress.available())):
+                stats.counters["malformed"] += 1
+                return
+            mss = min(proposed_mss, self.mss)
+            transfer = self.transfer(transfer_id, extension, size)
+            if length and addr not in clients:
+                clients[addr] = ClientState(1, max_packets_transmitted, transfer, offset, length, mss,
+                                            self.window_size, RECEIVERS[self.protocol][1], codec, encoded)
+                stats.counters["sessions"] += 1
+            elif addr in clients and clients[addr].rcv_base == 1:
+                clients[addr].max_packets = max_packets_transmitted
+                clients[addr].mss = mss
+            else:
+                group = 0   # The session keeps its decoder
+            if addr in clients:
+                client = clients[addr]
+                client.last_active = timer.now()
+                mss = client.mss
+                if self.protocol == 2 and group:
+                    client.fec = fec.Decoder(group, parity, client.max_packets, client.segment_length)
+            missing = transfer.missing()
+            answer = (f"{mss}:{ranges.encode(missing, MAX_RANGES)}:{','.join(compress.available())}"
+                      f":{sum(end - start for start, end in missing)}")
+            send_ack(outbox, stats, addr, 1, seq, self.window_size, bytes(answer, "utf-8"))
+            return
+
+        # Packets may arrive before the initialization
+        if addr not in clients:
+            return
+        client = clients[addr]
+        client.last_active = timer.now()
+        seq = seqnum.unwrap(seq, client.rcv_base, client.space)
+
+        # Segments larger than negotiated violate the handshake
+        if len(data_rcvd) > client.mss:
+            stats.counters["oversized"] += 1
+            return
+
+        RECEIVERS[self.protocol][0](self, outbox, client, seq, flags, data_rcvd, addr)
+
+    def finish(self, outbox, seq, data_rcvd, addr):
+        """
+        Ends a transfer: closes its sessions, whose own FIN may have been lost, and checks
+        the file against the client's digest. The FIN-ACK carries the verdict, and a FIN
+        resent while the check runs is answered once it is over.
+
+        Parameters:
+            outbox (dict): Acknowledgements waiting to be sent, keyed by address.
+            seq (int): Sequence number of the FIN, echoed in the FIN-ACK.
+            data_rcvd (memoryview): Payload of the FIN.
+            addr (tuple): The client's (host, port) tuple.
+        """
+        fields = parse_fields(data_rcvd, 4, (2,))
+        if fields is None or not fields[0].isalnum() or not fields[1].isalnum():
+            self.stats.counters["malformed"] += 1
+            return
+        extension, transfer_id, size, expected = fields
+        transfer = self.transfer(transfer_id, extension, size)
+        for client_addr in [client_addr for client_addr, client in self.clients.items() if client.transfer is transfer]:
+            self.clients.pop(client_addr).close()
+
+        if transfer.verifying:
+            return
+        elif transfer.finished and transfer.file_digest == expected:
+            verdict = digest.OK
+        elif transfer.mismatched:
+            verdict = digest.MISMATCH
+        elif not transfer.finished and transfer.missing():
+            verdict = digest.MISSING
+        else:
+            # The writer thread checks the file after the data queued before, and hands the verdict back to the loop
+            transfer.verify(expected, lambda verdict: self.loop.call_soon_threadsafe(lambda: self.verified(transfer, seq, verdict, addr)))
+            return
+        send_ack(outbox, self.stats, addr, seq, seq, self.window_size, fin = bytes(verdict, "utf-8"))
+
+    # Sends the verdict of a transfer's check to the client that ended it
+    def verified(self, transfer, seq, verdict, addr):
+        transfer.verified(verdict)
+        self.stats.counters["verified" if verdict == digest.OK else "mismatched"] += 1
+        self.stats.counters["digest_rereads"] += transfer.digest.reread
+        if metrics.LEVEL >= metrics.SUMMARY:
+            print(f"Server: Transfer {transfer.transfer_id} {'verified' if verdict == digest.OK else 'discarded, digest mismatch'}")
+        outbox = {}
+        send_ack(outbox, self.stats, addr, seq, seq, self.window_size, fin = bytes(verdict, "utf-8"))
+        self.send(outbox)
+        if verdict == digest.OK:
+            threading.Thread(target = self._index_file, args = (transfer.path,), name = "indexer", daemon = True).start()
+
+    # Chunks a verified file off the loop and indexes its chunks on it, so that later uploads deduplicate against every upload
+    def _index_file(self, path):
+        try:
+            entries = chunks.chunk_file(path)
+        except OSError:
+            return
+        name = os.path.basename(path)
+
+        def add():
+            for offset, length, chunk_digest in entries:
+                self.index.add(chunk_digest, name, offset, length)
+            self.stats.counters["indexed_chunks"] += len(entries)
+
+        self.loop.call_soon_threadsafe(add)
+
+    def reap_idle(self):
+        """
+        Closes the sessions of clients that went silent, e.g. because their "DONE" packet was lost,
+        and forgets the transfers left without a session, unless they wait for the client to end them.
+        """
+        now = timer.now()
+        for addr in [addr for addr, client in self.clients.items() if now - client.last_active > IDLE_TIMEOUT]:
+            self.clients.pop(addr).close()
+            if metrics.LEVEL >= metrics.SUMMARY:
+                print("Server: Session reaped - ", addr)
+        for transfer_id in [transfer_id for transfer_id, transfer in self.transfers.items() if transfer.idle()]:
+            del self.transfers[transfer_id]
+
+    def run(self):
+        """
+        Serves every client until stop() is called, then closes the server. A server runs once.
+
+        Returns:
+            metrics.Metrics: Server metrics.
+        """
+        self.listen()
+        try:
+            self.loop.run()
+        finally:
+            self.close()
+        return self.stats
+
+    def listen(self):
+        """
+        Registers the server's socket and timers with its loop, which serves the clients as it runs.
+        """
+        loop = self.loop
+        sock = self.sock
+        # Receive buffers fit the largest segment we grant
+        receiver = udt.BatchReceiver(sock, size = packet.HEADER_SIZE + self.mss)
+
+        # Drain every queued packet each time the socket wakes the loop, then send the ACKs in batches
+        def on_readable():
+            while True:
+                batch = receiver.recv()
+                if not batch:
+                    return
+                outbox = {}
+                for pkt, addr in batch:
+                    # A packet the server cannot handle is dropped, not allowed to stop the server
+                    try:
+                        self.receive(outbox, pkt, addr)
+                    except Exception as error:
+                        self.stats.counters["failed_packets"] += 1
+                        if metrics.LEVEL >= metrics.SUMMARY:
+                            print(f"Server: Packet from {addr} dropped - {error!r}")
+                self.send(outbox)
+
+        def on_reap():
+            self.reap_idle()
+            if self.index.dirty:
+                self.index.save()
+            loop.call_later(REAP_INTERVAL, on_reap)
+
+        loop.add_reader(sock, on_readable)
+        loop.call_later(REAP_INTERVAL, on_reap)
+
+    # Sends the acknowledgements of an outbox, each address's in a batch
+    def send(self, outbox):
+        for addr, ackpkts in outbox.items():
+            udt.send_batch(ackpkts, self.sock, addr)
+        self._schedule_flush()
+
+    # Sends the ACKs the channel delays once they are due
+    def _on_flush(self):
+        self._flush_handle = None
+        udt.CHANNEL.flush()
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        left = udt.CHANNEL.time_left()
+        if left is not None and self._flush_handle is None:
+            self._flush_handle = self.loop.call_later(left, self._on_flush)
+
+    def close(self):
+        """
+        Closes the sessions, waits for their data to be written and releases the socket and the loop.
+        """
+        for client in self.clients.values():
+            client.close()
+        self.clients.clear()
+        self.writer.stop()
+        self.stats.counters.update(disk_writes = self.writer.writes, disk_bytes = self.writer.written, disk_errors = self.writer.errors)
+        if self.index.dirty:
+            self.index.save()
+        self.loop.close()
+        self.sock.close()
+        self.stats.gauges.update(udt.CHANNEL.summary())
+
+    # Runs run() on a thread of its own
+    def start(self):
+        self.thread = threading.Thread(target = self.run, name = f"server-{self.server_address[1]}", daemon = True)
+        self.thread.start()
+
+    # Makes run() return, and waits for it to clean up if start() runs it; safe to call from any thread
+    def stop(self):
+        self.loop.stop()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
 
 
 def main():
     """
     Main function to start the server.
     """
-    # Create a TCP/IP socket
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-
-    # Bind the socket to the port
-    server_address = (HOST, port)
-    sock.bind(server_address)
-
-    clients = {}   # Store the states for multiple clients
-    while True:
-        pkt, addr = udt.recv(sock)
-        seq, checksum, data_rcvd = packet.extract(pkt)
-
-        if verify_checksum(seq, checksum, data_rcvd):
-            # End: close socket if "DONE" packet received
-            if checksum == b"DONE":
-                del clients[addr]
-                sock.close()
-                break
-            
-            # First: receive file extension to deliver following packets
-            if checksum == b"FIRST":
-                data_str = data_rcvd.decode("utf-8")
-                extension, max_packets_transmitted = data_str.split(":")
-                clients[addr] = ClientState(1, int(max_packets_transmitted))  # (current packet, max packets)
-
-            # Deliver the data
-            if checksum != b"FIRST" and (clients[addr].rcv_base % clients[addr].max_packets) == (seq % clients[addr].max_packets):
-                clients[addr].rcv_base += 1  # Update expected sequence number
-                output_file = f"{CACHE}{addr[0]}_{addr[1]}.{extension}"
-                with open(output_file, 'ab') as file:
-                    file.write(data_rcvd)
-
-            # Send acknowledgement
-            ack_to_send = "ACK - " + str(seq % clients[addr].max_packets)
-            ackpkt = packet.make(clients[addr].rcv_base % clients[addr].max_packets, create_checksum(clients[addr].rcv_base % clients[addr].max_packets , bytes(ack_to_send, "utf-8")).encode("utf-8"), bytes(ack_to_send, "utf-8"))
-            udt.send(ackpkt, sock, addr)
-            print("Server: Ack sent - %s", ack_to_send)
-    
-    
+    try:
+        server = Server(port, protocol, window_size, mss = mss, fsync = fsync, sndbuf = sndbuf, rcvbuf = rcvbuf,
+                        trace = trace_path is not None)
+    except ValueError as error:
+        print(f"Error: {error}")
+        sys.exit(2)
+
+    # Serve every client until interrupted or terminated
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        server.run()
+    finally:
+        stats = server.stats
+        if metrics.LEVEL >= metrics.SUMMARY:
+            stats.print_summary()
+        if metrics_path is not None:
+            stats.dump(metrics_path)
+        if trace_path is not None:
+            stats.trace.dump(trace_path)
+
+
 if __name__ == "__main__":
     # Check command-line arguments
+    usage = 'Usage : "python server.py -p port -r protocol -n window_size (0 - SnW, 1 - GBN, 2 - SR)"\n[port: port number that server will bind and listen on]\n[protocol: protocol the server will use (SnW, GBN or SR)]\n[window_size: window size used by the sender/receiver in GBN and SR]\nOptional: -c checksum [inet (default), crc32 or crc32c (pure Python, about 8k packets/s, unless the crc32c package is installed); must match the client]\n          -mss bytes [largest maximum segment size granted to clients, 65487 by default]\n          -sndbuf bytes -rcvbuf bytes [socket buffer sizes, system default otherwise]\n          -fsync policy [none (default), close (before closing a file) or always (after every write)]\n          -v level [0 - quiet, 1 - summary (default), 2 - every packet] -trace file [.jsonl for JSON lines] -metrics file [JSON summary]\n          -loss p -ge to_bad,to_good[,bad_loss] -corrupt p -delay ms -jitter ms -reorder p -bw mbps -seed n [channel impairments of the ACK path]'
     if len(sys.argv) < 7:
-        print('Usage : "python server.py -p port -r protocol -n window_size (0 - SnW, 1 - GBN)"\n[port: port number that server will bind and listen on]\n[protocol: protocol the server will use (SnW or GBN)]\n[window_size: window size used by the sender/receiver in GBN]')
+        print(usage)
         sys.exit(2)
     
     # Parse command-line arguments
@@ -164,6 +1001,17 @@ if __name__ == "__main__":
     port = int(args['-p'])
     protocol = int(args['-r'])
     window_size = int(args['-n'])
+    integrity.MODE = args.get('-c', integrity.MODE)
+    if integrity.MODE not in integrity.MODES:
+        print(f"Error: Checksum must be one of {', '.join(integrity.MODES)}.")
+        print(usage)
+        sys.exit(2)
+    udt.configure(args)
+    trace_path, metrics_path = metrics.configure(args)
+    mss = int(args.get('-mss', MSS))
+    sndbuf = int(args['-sndbuf']) if '-sndbuf' in args else None
+    rcvbuf = int(args['-rcvbuf']) if '-rcvbuf' in args else None
+    fsync = args.get('-fsync', "none")
 
     # Start the server
     main()
@@ -0,0 +1,409 @@
+# sim.py - Discrete-event simulation: a virtual clock and an in-memory network standing in for real time and UDP
+#
+# While a Network is installed, udt opens its sockets, waits and drains through it and timer.now()
+# reads its clock, so client.py and server.py run their usual code paths. Nothing sleeps: whenever
+# every socket is idle, the clock jumps to the next event, i.e. a timer of the server's loop, a
+# packet the channel delays or the deadline of the wait. A run takes as long as its Python code.
+#
+# One simulation runs at a time per process, on one thread. Both ends share udt.CHANNEL, which
+# impairs data and acknowledgements alike.
+import collections
+import errno
+import filecmp
+import heapq
+import itertools
+import math
+import os
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+import client
+import metrics
+import server
+import timer
+import udt
+
+HOST = "127.0.0.1"
+EPHEMERAL = 49152       # First port handed out to sockets that send before binding
+DELAY = 0.001           # One-way delay in seconds of the link of the sweep and of benchmark.py -sim
+
+
+class Socket(object):
+    """
+    Datagram socket of a Network, with the calls udt, client.py and server.py make.
+
+    Sent packets are copied into the receiver's queue; nothing runs until the network does.
+    """
+    family = socket.AF_UNSPEC   # Not AF_INET, so udt sends and receives one datagram per call
+
+    def __init__(self, network):
+        self.network = network
+        self.address = None
+        self.queue = collections.deque()    # (packet, sender's address)
+
+    def bind(self, address):
+        self.network.bind(self, address)
+
+    def getsockname(self):
+        return self.address
+
+    def sendto(self, data, address):
+        if self.address is None:
+            self.bind((HOST, 0))
+        self.network.deliver(bytes(data), self.address, address)
+        return len(data)
+
+    def recvfrom(self, size):
+        if not self.queue:
+            raise BlockingIOError(errno.EAGAIN, "No datagram queued")
+        data, address = self.queue.popleft()
+        return data[:size], address
+
+    def recvfrom_into(self, buffer):
+        data, address = self.recvfrom(len(buffer))
+        buffer[:len(data)] = data
+        return len(data), address
+
+    # Sockets of a network never block and have no kernel buffers
+    def setblocking(self, flag):
+        pass
+
+    def setsockopt(self, *args):
+        pass
+
+    def close(self):
+        self.network.unbind(self)
+        self.queue.clear()
+
+
+class Network(object):
+    """
+    In-memory network with a virtual clock, and the event loop of the server on it.
+
+    Sockets are known by port, all on one host. Install it with a with statement,
+    which restores real sockets and time on exit.
+
+    Attributes:
+        now (float): Virtual time in seconds.
+        deadline (float): Virtual time past which waiting raises TimeoutError, None for no limit.
+        settle (function): Waits for background threads, e.g. the server's writer, before the clock moves; None if there are none.
+    """
+
+    def __init__(self):
+        self.now = 0.0
+        self.deadline = None
+        self.settle = None
+        self._ready = collections.deque()   # Callbacks handed over by other threads
+        self._lock = threading.Lock()
+        self._sockets = {}                  # Bound sockets keyed by port
+        self._ports = itertools.count(EPHEMERAL)
+        self._readers = {}                  # Callbacks keyed by socket
+        self._timers = []                   # Heap of [time, order, callback]
+        self._order = itertools.count()
+        self._stopped = False
+        self._saved = None
+
+    def __enter__(self):
+        self._saved = (udt.NETWORK, timer.CLOCK)
+        udt.NETWORK = self
+        timer.CLOCK = self.time
+        return self
+
+    def __exit__(self, *exc):
+        udt.NETWORK, timer.CLOCK = self._saved
+
+    # Gets the virtual time, the clock of timer.now()
+    def time(self):
+        return self.now
+
+    # Creates an unbound socket
+    def socket(self):
+        return Socket(self)
+
+    def bind(self, sock, address):
+        host, port = address
+        port = port or next(self._ports)
+        while port in self._sockets and address[1] == 0:
+            port = next(self._ports)
+        if port in self._sockets:
+            raise OSError(errno.EADDRINUSE, f"Port {port} is in use")
+        sock.address = (HOST, port)
+        self._sockets[port] = sock
+
+    def unbind(self, sock):
+        if sock.address is not None and self._sockets.get(sock.address[1]) is sock:
+            del self._sockets[sock.address[1]]
+
+    # Queues a packet at the socket bound to address; packets to nowhere are lost, as with UDP
+    def deliver(self, data, source, address):
+        sock = self._sockets.get(address[1])
+        if sock is not None:
+            sock.queue.append((data, source))
+
+    # Event loop interface of server.Server, as eventloop.EventLoop
+
+    # Calls callback() whenever sock has packets queued
+    def add_reader(self, sock, callback):
+        self._readers[sock] = callback
+
+    # Stops watching sock
+    def remove_reader(self, sock):
+        self._readers.pop(sock, None)
+
+    # Calls callback() once, after delay virtual seconds; returns a handle for cancel()
+    def call_later(self, delay, callback):
+        handle = [self.now + delay, next(self._order), callback]
+        heapq.heappush(self._timers, handle)
+        return handle
+
+    # Cancels a callback scheduled with call_later()
+    def cancel(self, handle):
+        handle[2] = None
+
+    # Gets the virtual time left before the next scheduled callback, or None if there is none
+    def time_left(self):
+        while self._timers and self._timers[0][2] is None:
+            heapq.heappop(self._timers)
+        if self._timers:
+            return max(0, self._timers[0][0] - self.now)
+        else:
+            return None
+
+    # Runs the events until stop() is called, even before run(), or nothing is left to happen
+    def run(self):
+        while not self._stopped:
+            self._run_ready()
+            due = self._next_event()
+            if due is None:
+                return
+            self.now = max(self.now, due)
+
+    # Calls callback() on the simulation's thread as soon as it can; safe to call from any thread
+    def call_soon_threadsafe(self, callback):
+        with self._lock:
+            self._ready.append(callback)
+
+    # Makes run() return
+    def stop(self):
+        self._stopped = True
+
+    # Forgets the readers and timers
+    def close(self):
+        self._readers.clear()
+        self._timers.clear()
+
+    # Scheduling
+
+    # Runs the due timers, sends the due delayed packets and lets the readers drain their sockets, until nothing is left to do
+    # Background work takes no virtual time: what it hands over runs before the clock moves
+    def _run_ready(self):
+        while True:
+            progressed = False
+            with self._lock:
+                ready, self._ready = self._ready, collections.deque()
+            for callback in ready:
+                callback()
+                progressed = True
+            while self._timers and (self._timers[0][2] is None or self._timers[0][0] <= self.now):
+                _, _, callback = heapq.heappop(self._timers)
+                if callback is not None:
+                    callback()
+                    progressed = True
+            udt.CHANNEL.flush()
+            for sock, callback in list(self._readers.items()):
+                if sock.queue:
+                    callback()
+                    progressed = True
+            if not progressed:
+                if self.settle is not None:
+                    self.settle()
+                if not self._ready:
+                    return
+
+    # Gets the virtual time of the next timer or delayed packet, or None if there is none
+    def _next_event(self):
+        due = [self.now + left for left in (self.time_left(), udt.CHANNEL.time_left()) if left is not None]
+        return min(due) if due else None
+
+    def wait(self, sock, timeout):
+        """
+        Runs the network until sock has a packet queued or timeout virtual seconds pass, as udt.wait.
+
+        Parameters:
+            sock (Socket): The socket waited on, not watched by a reader.
+            timeout (float): Virtual seconds to wait.
+
+        Returns:
+            bool: True if a packet is queued.
+
+        Raises:
+            TimeoutError: If the wait would go past the network's deadline.
+        """
+        # The clock moves on however small the timeout, or a timer could never expire
+        deadline = max(self.now + timeout, math.nextafter(self.now, math.inf))
+        if self.deadline is not None and deadline > self.deadline:
+            raise TimeoutError("The simulated run went past its time limit.")
+        while True:
+            self._run_ready()
+            if sock.queue:
+                return True
+            due = self._next_event()
+            if due is None or due >= deadline:
+                self.now = deadline
+                self._run_ready()
+                return bool(sock.queue)
+            self.now = max(self.now, due)
+
+    # Runs the network until the channel has no delayed packets left, as udt.drain
+    def drain(self):
+        while True:
+            self._run_ready()
+            left = udt.CHANNEL.time_left()
+            if left is None:
+                return
+            self.now += left
+
+
+class Simulation(object):
+    """
+    A server on a Network, taking one upload after another in virtual time.
+
+    Use it in a with statement, which installs the network and the channel and
+    starts the server in a scratch directory, and undoes all of it on exit.
+    Each upload gets a transfer ID of its own; the server keeps the file of the
+    last one only, so that it can be compared with matches().
+
+    Attributes:
+        network (Network): The simulated network and clock.
+        server (server.Server): The server, once entered.
+        uploads (int): Uploads started.
+    """
+
+    def __init__(self, protocol, window_size, channel = None, limit = None, **options):
+        """
+        Initializes a Simulation object.
+
+        Parameters:
+            protocol (int): Protocol of the server and the uploads.
+            window_size (int): Window size of the server, and of the uploads unless they set their own.
+            channel (udt.Channel): Impairments of both directions, the current udt.CHANNEL if None.
+            limit (float): Virtual seconds an upload may take, None for no limit.
+            options: Other settings of server.Server, e.g. mss or fsync.
+        """
+        self.protocol = protocol
+        self.window_size = window_size
+        self.channel = channel
+        self.limit = limit
+        self.options = options
+        self.network = Network()
+        self.server = None
+        self.uploads = 0
+        self._received = None   # Path of the last upload's file on the server
+        self._scratch = None
+        self._channel = None
+
+    def __enter__(self):
+        self._scratch = tempfile.TemporaryDirectory()
+        self._channel = udt.CHANNEL
+        if self.channel is not None:
+            udt.CHANNEL = self.channel
+        self.network.__enter__()
+        try:
+            self.server = server.Server(0, self.protocol, self.window_size, directory = self._scratch.name,
+                                        index_path = os.path.join(self._scratch.name, server.INDEX), loop = self.network, **self.options)
+            self.server.listen()
+            self.network.settle = self.server.writer.flush
+        except BaseException:
+            self.__exit__(*sys.exc_info())
+            raise
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            if self.server is not None:
+                self.server.close()
+        finally:
+            self.network.__exit__(*exc)
+            udt.CHANNEL = self._channel
+            self._scratch.cleanup()
+
+    def upload(self, file_path, **options):
+        """
+        Uploads a file to the server, until the server has all of it.
+
+        Parameters:
+            file_path (str): Path of the file to upload.
+            options: Other settings of client.Connection, e.g. window_size, mss or rto_min.
+
+        Returns:
+            metrics.Metrics: Metrics of the transfer, timed in virtual seconds.
+
+        Raises:
+            ValueError: If a setting is invalid, e.g. more than one flow.
+            ConnectionError: If the server stops answering or the transfer makes no progress.
+            TimeoutError: If the upload takes longer than the limit.
+        """
+        # Parallel flows are threads, which one virtual timeline cannot interleave
+        if options.get("flows", 1) != 1:
+            raise ValueError("A simulated upload has one flow.")
+        if self._received is not None:
+            # The writer thread may still save or remove the ranges
+            for path in (self._received, self._received + ".part", self._received + ".ranges", self._received + ".digest"):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+        self.uploads += 1
+        options.setdefault("window_size", self.window_size)
+        options.setdefault("transfer_id", f"sim{self.uploads}")
+        conn = client.Connection(file_path, self.server.server_address[1], self.protocol, **options)
+        self._received = os.path.join(self.server.directory, f"{conn.transfer_id}.{conn.file_path.split('.')[-1]}")
+        self.network.deadline = None if self.limit is None else self.network.now + self.limit
+        try:
+            return client.upload(conn)
+        finally:
+            self.network.deadline = None
+
+    def matches(self, file_path):
+        """
+        Determines whether the server received the last upload intact, once its data is written.
+
+        Parameters:
+            file_path (str): Path of the file uploaded last.
+
+        Returns:
+            bool: True if the server's copy is identical.
+        """
+        self.server.writer.flush()
+        return self._received is not None and os.path.exists(self._received) and filecmp.cmp(self._received, file_path, shallow = False)
+
+
+if __name__ == "__main__":
+    # Sweep: python sim.py [file] [uploads] [window_sizes] [loss_rates]
+    # Every protocol uploads the file the given number of times for each window size and loss rate,
+    # over a link with a DELAY one-way delay, and checks the last upload of each case
+    file_path = os.path.join(client.CACHE, sys.argv[1] if len(sys.argv) > 1 else "file1.txt")
+    uploads = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    window_sizes = [int(value) for value in (sys.argv[3] if len(sys.argv) > 3 else "1,4,16").split(',')]
+    losses = [float(value) for value in (sys.argv[4] if len(sys.argv) > 4 else "0,0.05,0.2").split(',')]
+    metrics.LEVEL = metrics.QUIET
+    size = os.path.getsize(file_path)
+
+    print(f"{os.path.basename(file_path)}: {size} bytes, {uploads} uploads per case")
+    for protocol in sorted(client.SENDERS.keys() & server.RECEIVERS.keys()):
+        for window_size in (window_sizes[:1] if protocol == 0 else window_sizes):
+            for loss in losses:
+                times = []
+                start = time.perf_counter()
+                with Simulation(protocol, window_size, udt.Channel(loss = loss, delay = DELAY, seed = 0)) as simulation:
+                    for _ in range(uploads):
+                        times.append(simulation.upload(file_path).gauges["time"])
+                    ok = simulation.matches(file_path)
+                elapsed = time.perf_counter() - start
+                print(f"protocol {protocol}, window {window_size:3d}, loss {loss:4.2f}: "
+                      f"{size / statistics.mean(times) / 1e6:8.3f} MB/s simulated, {uploads / elapsed:7.0f} uploads/s, "
+                      f"{'ok' if ok else 'MISMATCH'}")
@@ -1,17 +1,32 @@
 # timer.py - A timer class
+import heapq
+import itertools
 import time
 
+CLOCK = time.time   # Gets the current time in seconds; a virtual clock during simulations (sim.py)
+
+
+# Gets the current time in seconds, from CLOCK
+def now():
+    return CLOCK()
+
+
 class Timer(object):
     TIMER_STOP = -1
 
+    # duration is either a number of seconds or a callable returning one,
+    # such as rto.RTOEstimator.rto, read again every time the timer starts
     def __init__(self, duration):
         self._start_time = self.TIMER_STOP
-        self._duration = duration
+        self._source = duration
+        self._duration = duration() if callable(duration) else duration
 
     # Starts the timer
     def start(self):
         if self._start_time == self.TIMER_STOP:
-            self._start_time = time.time()
+            self._start_time = now()
+            if callable(self._source):
+                self._duration = self._source()
 
     # Stops the timer
     def stop(self):
@@ -27,11 +42,62 @@ class Timer(object):
         if not self.running():
             return False
         else:
-            return time.time() - self._start_time >= self._duration
+            return now() - self._start_time >= self._duration
     
     # Gets the amount of time left before timeout
     def time_left(self):
         if self.running():
-            return max(0, self._duration - (time.time() - self._start_time))
+            return max(0, self._duration - (now() - self._start_time))
+        else:
+            return 0
+
+
+# A queue of per-packet timers ordered by deadline
+class TimerQueue(object):
+
+    def __init__(self):
+        self._timers = {}
+        self._deadlines = []
+        self._order = itertools.count()
+
+    # Starts a timer of the given duration for key, replacing any running one
+    def start(self, key, duration):
+        self.stop(key)
+        timer = Timer(duration)
+        timer.start()
+        self._timers[key] = timer
+        heapq.heappush(self._deadlines, (timer._start_time + timer._duration, next(self._order), key, timer))
+
+    # Stops the timer for key, if any
+    def stop(self, key):
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.stop()
+
+    # Determines whether any timer is running
+    def running(self):
+        return bool(self._timers)
+
+    # Pops and returns the keys of all timers that timed out
+    def expired(self):
+        keys = []
+        while self._deadlines:
+            _, _, key, timer = self._deadlines[0]
+            if timer.running() and not timer.timeout():
+                break
+            heapq.heappop(self._deadlines)
+            # Skip timers that were stopped since they were queued
+            if timer.running():
+                del self._timers[key]
+                timer.stop()
+                keys.append(key)
+        return keys
+
+    # Gets the amount of time left before the earliest timeout
+    def time_left(self):
+        while self._deadlines and not self._deadlines[0][3].running():
+            heapq.heappop(self._deadlines)
+        if self._deadlines:
+            return self._deadlines[0][3].time_left()
         else:
-            return 0
\ No newline at end of file
+            return 0
@@ -1,21 +1,405 @@
 # udt.py - Unreliable data transfer using UDP
+import ctypes
+import errno
+import heapq
+import itertools
 import random
+import select
 import socket
+import struct
+import sys
+import threading
+import time
+import timer
 
 
-DROP_PROB = .5
-CORR_PROB = .5
+# The original channel dropped a packet when random.randint(0, 10) > .5 was false,
+# i.e. only for 0: 1 in 11, about 9% loss, so that stays the default
+LOSS = 1 / 11
+REORDER_DELAY = 0.005   # Seconds a reordered packet is held back beyond its normal delay
+
+BATCH_SIZE = 64         # Datagrams moved per batched system call
+BUFFER_SIZE = 2048      # Bytes of each preallocated receive buffer, unless sized to the MSS
+
+DEFAULT_MTU = 1500      # Path MTU assumed when it cannot be probed
+IP_OVERHEAD = 28        # IPv4 and UDP header bytes of every datagram
+MAX_DATAGRAM = 65507    # Largest UDP payload over IPv4
+
+# Linux socket options, missing from the socket module
+_IP_MTU_DISCOVER = getattr(socket, "IP_MTU_DISCOVER", 10)
+_IP_PMTUDISC_DO = getattr(socket, "IP_PMTUDISC_DO", 2)
+_IP_MTU = getattr(socket, "IP_MTU", 14)
+
+
+class Channel(object):
+    """
+    Impairment model applied to every packet sent through this module.
+
+    Packets may be lost (independently, or in bursts following a Gilbert-Elliott
+    chain), have a bit flipped, be delayed with jitter, be reordered and be queued
+    behind a bandwidth limit. Delayed packets wait in a heap and are sent by flush(),
+    which the receive functions call while they wait, so nothing ever sleeps.
+    A seed makes the impairments reproducible.
+
+    Attributes:
+        loss (float): Loss probability; the good-state loss under Gilbert-Elliott.
+        burst (tuple): Gilbert-Elliott (good to bad, bad to good, bad-state loss) probabilities, or None.
+        corrupt (float): Probability of flipping one bit of a packet.
+        delay (float): Fixed one-way delay in seconds.
+        jitter (float): Maximum extra uniform random delay in seconds.
+        reorder (float): Probability of holding a packet back by REORDER_DELAY.
+        bandwidth (float): Link rate in bits per second, or None for unlimited.
+    """
+
+    def __init__(self, loss = LOSS, burst = None, corrupt = 0, delay = 0, jitter = 0, reorder = 0, bandwidth = None, seed = None):
+        self.loss = loss
+        self.burst = burst
+        self.corrupt = corrupt
+        self.delay = delay
+        self.jitter = jitter
+        self.reorder = reorder
+        self.bandwidth = bandwidth
+        self.random = random.Random(seed)
+        self.sent = self.lost = self.corrupted = self.reordered = 0
+        self._bad = False           # Gilbert-Elliott state
+        self._link_free = 0         # Time the bandwidth-limited link finishes its queue
+        self._pending = []          # Heap of (due time, order, packet, sock, addr)
+        self._order = itertools.count()
+        self._lock = threading.Lock()   # Parallel flows share the channel
+
+    def _dropped(self):
+        if self.burst is None:
+            return self.random.random() < self.loss
+        to_bad, to_good, bad_loss = self.burst
+        # Step the two-state chain once per packet, then lose with the state's probability
+        if self._bad:
+            self._bad = self.random.random() >= to_good
+        else:
+            self._bad = self.random.random() < to_bad
+        return self.random.random() < (bad_loss if self._bad else self.loss)
+
+    def _corrupted(self, pkt):
+        data = bytearray(pkt)
+        if data:
+            data[self.random.randrange(len(data))] ^= 1 << self.random.randrange(8)
+        return data
+
+    # Applies the impairments to a burst of packets for one address
+    # Returns the packets to send right away; delayed ones are queued for flush()
+    def transmit(self, packets, sock, addr):
+        with self._lock:
+            return self._transmit(packets, sock, addr)
+
+    def _transmit(self, packets, sock, addr):
+        now = timer.now()
+        immediate = []
+        for pkt in packets:
+            self.sent += 1
+            if self._dropped():
+                self.lost += 1
+                continue
+            if self.corrupt and self.random.random() < self.corrupt:
+                pkt = self._corrupted(pkt)
+                self.corrupted += 1
+            due = now
+            if self.bandwidth:
+                self._link_free = max(self._link_free, now) + len(pkt) * 8 / self.bandwidth
+                due = self._link_free
+            due += self.delay
+            if self.jitter:
+                due += self.random.uniform(0, self.jitter)
+            if self.reorder and self.random.random() < self.reorder:
+                due += REORDER_DELAY
+                self.reordered += 1
+            if due <= now:
+                immediate.append(pkt)
+            else:
+                # Copy: the caller reuses its buffers before the packet is due
+                heapq.heappush(self._pending, (due, next(self._order), bytes(pkt), sock, addr))
+        return immediate
+
+    # Sends every delayed packet that is due
+    def flush(self):
+        now = timer.now()
+        with self._lock:
+            while self._pending and self._pending[0][0] <= now:
+                _, _, pkt, sock, addr = heapq.heappop(self._pending)
+                try:
+                    sock.sendto(pkt, addr)
+                except OSError:
+                    pass
+
+    # Gets the seconds until the next delayed packet is due, None if none is queued
+    def time_left(self):
+        if not self._pending:
+            return None
+        return max(0, self._pending[0][0] - timer.now())
+
+    # Gets the impairment counters, for the transfer metrics
+    def summary(self):
+        return {"channel_offered": self.sent, "channel_lost": self.lost,
+                "channel_corrupted": self.corrupted, "channel_reordered": self.reordered}
+
+
+CHANNEL = Channel()
+NETWORK = None          # Simulated network standing in for UDP (sim.Network), None for real sockets
+
+
+# Creates a non-blocking UDP socket, or a simulated one while NETWORK is set
+def open_socket():
+    if NETWORK is not None:
+        return NETWORK.socket()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setblocking(0)
+    return sock
+
+
+def configure(args):
+    """
+    Replaces the channel with one built from the command-line options.
+
+    Options: -loss p, -ge to_bad,to_good[,bad_loss], -corrupt p, -delay ms,
+    -jitter ms, -reorder p, -bw Mbit/s and -seed n.
+
+    Parameters:
+        args (dict): Parsed command-line flags and their values.
+    """
+    global CHANNEL
+    burst = None
+    if '-ge' in args:
+        burst = [float(value) for value in args['-ge'].split(',')]
+        if len(burst) == 2:
+            burst.append(1.0)
+        burst = tuple(burst)
+    CHANNEL = Channel(loss = float(args.get('-loss', LOSS)),
+                      burst = burst,
+                      corrupt = float(args.get('-corrupt', 0)),
+                      delay = float(args.get('-delay', 0)) / 1000,
+                      jitter = float(args.get('-jitter', 0)) / 1000,
+                      reorder = float(args.get('-reorder', 0)),
+                      bandwidth = float(args['-bw']) * 1e6 if '-bw' in args else None,
+                      seed = int(args['-seed']) if '-seed' in args else None)
 
 # Send a packet across the unreliable channel
-# Packet may be lost or corrupted
+# Packet may be lost, corrupted, delayed or reordered
 def send(packet, sock, addr):
-    if random.randint(0, 10) > DROP_PROB:
-        sock.sendto(packet, addr)
+    for pkt in CHANNEL.transmit([packet], sock, addr):
+        sock.sendto(pkt, addr)
+
+# Send a burst of packets to one address across the unreliable channel
+# The packets the channel passes right away go out in as few system calls as possible
+def send_batch(packets, sock, addr):
+    survivors = CHANNEL.transmit(packets, sock, addr)
+    if _mmsg is not None and sock.family == socket.AF_INET:
+        for i in range(0, len(survivors), BATCH_SIZE):
+            _mmsg.sendmmsg(sock, survivors[i:i + BATCH_SIZE], addr)
+    else:
+        for packet in survivors:
+            sock.sendto(packet, addr)
+
+# Sends every delayed packet still queued in the channel, waiting until each is due
+def drain():
+    if NETWORK is not None:
+        return NETWORK.drain()
+    while True:
+        left = CHANNEL.time_left()
+        if left is None:
+            return
+        time.sleep(left)
+        CHANNEL.flush()
+
+# Waits up to timeout seconds for the socket to become readable
+# Delayed packets are sent as they come due while waiting
+def wait(sock, timeout):
+    if NETWORK is not None:
+        return NETWORK.wait(sock, timeout)
+    deadline = time.time() + timeout
+    while True:
+        CHANNEL.flush()
+        remaining = deadline - time.time()
+        left = CHANNEL.time_left()
+        if left is not None:
+            remaining = min(remaining, left)
+        if select.select([sock], [], [], max(0, remaining))[0]:
+            return True
+        if time.time() >= deadline:
+            CHANNEL.flush()
+            return False
 
 # Receive a packet from the unreliable channel
-def recv(sock):
+# Sleeps up to timeout seconds until a packet arrives instead of busy-polling
+def recv(sock, timeout = 0, size = MAX_DATAGRAM):
+    if timeout and not wait(sock, timeout):
+        return None, None
     try:
-        packet, addr = sock.recvfrom(1024)
+        packet, addr = sock.recvfrom(size)
         return packet, addr
     except socket.error:
         return None, None
+
+# Probes the path MTU towards addr from the kernel's route and PMTU cache (Linux), DEFAULT_MTU elsewhere
+def path_mtu(addr):
+    if NETWORK is not None or not sys.platform.startswith("linux"):
+        return DEFAULT_MTU
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+        try:
+            probe.setsockopt(socket.IPPROTO_IP, _IP_MTU_DISCOVER, _IP_PMTUDISC_DO)
+            probe.connect(addr)
+            return probe.getsockopt(socket.IPPROTO_IP, _IP_MTU)
+        except OSError:
+            return DEFAULT_MTU
+
+# Largest datagram payload that crosses a path of the given MTU without fragmentation
+def max_payload(mtu):
+    return min(mtu - IP_OVERHEAD, MAX_DATAGRAM)
+
+# Sets the kernel send and receive buffer sizes of sock in bytes; None keeps the system default
+def set_buffers(sock, sndbuf = None, rcvbuf = None):
+    if sndbuf is not None:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, sndbuf)
+    if rcvbuf is not None:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+
+
+class BatchReceiver(object):
+    """
+    Drains every queued datagram of a socket into preallocated buffers.
+
+    Uses recvmmsg on Linux, one recvfrom_into per datagram elsewhere.
+    """
+
+    def __init__(self, sock, count = BATCH_SIZE, size = BUFFER_SIZE):
+        self.sock = sock
+        self._buffers = [bytearray(size) for _ in range(count)]
+        self._views = [memoryview(buffer) for buffer in self._buffers]
+        self._mmsg = _mmsg.receiver(self._buffers) if _mmsg is not None and sock.family == socket.AF_INET else None
+
+    # Waits up to timeout seconds for packets and returns every queued (packet, addr) pair
+    # The packets are views into the buffers, valid only until the next call
+    def recv(self, timeout = 0):
+        if timeout and not wait(self.sock, timeout):
+            return []
+        if self._mmsg is not None:
+            return self._mmsg.recv(self.sock, self._views)
+
+        received = []
+        for view in self._views:
+            try:
+                length, addr = self.sock.recvfrom_into(view)
+            except (BlockingIOError, InterruptedError):
+                break
+            except socket.error:
+                break
+            received.append((view[:length], addr))
+        return received
+
+
+class _IOVec(ctypes.Structure):
+    _fields_ = [("base", ctypes.c_void_p), ("len", ctypes.c_size_t)]
+
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [("name", ctypes.c_void_p), ("namelen", ctypes.c_uint32),
+                ("iov", ctypes.POINTER(_IOVec)), ("iovlen", ctypes.c_size_t),
+                ("control", ctypes.c_void_p), ("controllen", ctypes.c_size_t),
+                ("flags", ctypes.c_int)]
+
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [("hdr", _MsgHdr), ("len", ctypes.c_uint)]
+
+
+class _MMsg(object):
+    # sendmmsg/recvmmsg through ctypes: the whole batch costs a single system call
+    MSG_DONTWAIT = 0x40
+    SOCKADDR_SIZE = 16
+
+    def __init__(self, libc):
+        self._sendmmsg = libc.sendmmsg
+        self._recvmmsg = libc.recvmmsg
+        self._sendmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int]
+        self._recvmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+        self._addresses = {}
+
+    def _sockaddr(self, addr):
+        name = self._addresses.get(addr)
+        if name is None:
+            raw = struct.pack("=H", socket.AF_INET) + struct.pack("!H", addr[1]) + socket.inet_aton(addr[0]) + bytes(8)
+            name = self._addresses[addr] = ctypes.create_string_buffer(raw, self.SOCKADDR_SIZE)
+        return name
+
+    def sendmmsg(self, sock, packets, addr):
+        count = len(packets)
+        name = self._sockaddr(addr)
+        iovecs = (_IOVec * count)()
+        messages = (_MMsgHdr * count)()
+        keep = []
+        for i, packet in enumerate(packets):
+            try:
+                data = (ctypes.c_char * len(packet)).from_buffer(packet)
+            except TypeError:
+                data = (ctypes.c_char * len(packet)).from_buffer_copy(packet)
+            keep.append(data)
+            iovecs[i].base = ctypes.addressof(data)
+            iovecs[i].len = len(packet)
+            messages[i].hdr.name = ctypes.addressof(name)
+            messages[i].hdr.namelen = self.SOCKADDR_SIZE
+            messages[i].hdr.iov = ctypes.pointer(iovecs[i])
+            messages[i].hdr.iovlen = 1
+        sent = 0
+        while sent < count:
+            result = self._sendmmsg(sock.fileno(), ctypes.addressof(messages) + sent * ctypes.sizeof(_MMsgHdr), count - sent, 0)
+            if result < 0:
+                error = ctypes.get_errno()
+                if error == errno.EINTR:
+                    continue
+                # The socket buffer is full: drop the rest, as a congested link would
+                break
+            sent += result
+
+    def receiver(self, buffers):
+        return _MMsgReceiver(self, buffers)
+
+
+class _MMsgReceiver(object):
+
+    def __init__(self, mmsg, buffers):
+        count = len(buffers)
+        self._mmsg = mmsg
+        self._count = count
+        self._data = [(ctypes.c_char * len(buffer)).from_buffer(buffer) for buffer in buffers]
+        self._names = [ctypes.create_string_buffer(mmsg.SOCKADDR_SIZE) for _ in range(count)]
+        self._iovecs = (_IOVec * count)()
+        self._messages = (_MMsgHdr * count)()
+        for i in range(count):
+            self._iovecs[i].base = ctypes.addressof(self._data[i])
+            self._iovecs[i].len = len(buffers[i])
+            self._messages[i].hdr.name = ctypes.addressof(self._names[i])
+            self._messages[i].hdr.iov = ctypes.pointer(self._iovecs[i])
+            self._messages[i].hdr.iovlen = 1
+
+    def recv(self, sock, views):
+        for i in range(self._count):
+            self._messages[i].hdr.namelen = self._mmsg.SOCKADDR_SIZE
+        result = self._mmsg._recvmmsg(sock.fileno(), ctypes.addressof(self._messages), self._count, self._mmsg.MSG_DONTWAIT, None)
+        if result < 0:
+            return []
+        received = []
+        for i in range(result):
+            raw = self._names[i].raw
+            addr = (socket.inet_ntoa(raw[4:8]), struct.unpack("!H", raw[2:4])[0])
+            received.append((views[i][:self._messages[i].len], addr))
+        return received
+
+
+def _load_mmsg():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(None, use_errno = True)
+        return _MMsg(libc)
+    except (OSError, AttributeError):
+        return None
+
+
+_mmsg = _load_mmsg()
@@ -0,0 +1,160 @@
+# writer.py - Write-behind: a thread that writes delivered data to disk, off the ACK path
+import collections
+import os
+import threading
+
+
+FSYNC = ("none", "close", "always")   # When data is forced to disk: never, before closing a file, after every write
+MAX_BUFFERS = 1024                      # Buffers per pwritev, the usual IOV_MAX
+
+
+class Writer(object):
+    """
+    Queue of writes drained by a writer thread.
+
+    Delivered data is queued and acknowledged right away. The thread sorts what
+    queued up since it last woke and writes each run of contiguous data of a file
+    with one pwritev. The queue is bounded softly: write never blocks, but free()
+    shrinks as it fills, and the server advertises a window that fits in it.
+    A write or close that fails is not retried: its data is dropped and its done
+    callback gets the error, so the owner of the file can give up on it.
+
+    Attributes:
+        capacity (int): Bytes the queue is meant to hold.
+        fsync (str): One of FSYNC.
+        queued (int): Bytes queued and not written yet.
+        writes (int): pwritev calls made.
+        written (int): Bytes written.
+        errors (int): Writes and closes that failed.
+    """
+
+    def __init__(self, capacity, fsync = "none"):
+        self.capacity = capacity
+        self.fsync = fsync
+        self.queued = 0
+        self.writes = 0
+        self.written = 0
+        self.errors = 0
+        self._jobs = collections.deque()    # (fd, offset, data, done); data is None to close fd, and fd too to only call done
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._busy = False                  # Whether the thread is writing jobs it took off the queue
+        self._thread = threading.Thread(target = self._run, name = "writer", daemon = True)
+        self._thread.start()
+
+    # Gets the bytes the queue can take before it is full
+    def free(self):
+        return max(0, self.capacity - self.queued)
+
+    # Queues data to be written at an offset of a file; the writer thread calls done(offset, data, error) once it is,
+    # error being the OSError the write failed with or None
+    def write(self, fd, offset, data, done = None):
+        with self._condition:
+            self._jobs.append((fd, offset, data, done))
+            self.queued += len(data)
+            self._condition.notify_all()
+
+    # Queues closing a file once everything queued before is written; the writer thread calls done(error) after
+    def close(self, fd, done = None):
+        with self._condition:
+            self._jobs.append((fd, None, None, done))
+            self._condition.notify_all()
+
+    # Queues a call to done() on the writer thread, once everything queued before is written
+    def call(self, done):
+        with self._condition:
+            self._jobs.append((None, None, None, done))
+            self._condition.notify_all()
+
+    # Waits until everything queued so far is written and closed
+    def flush(self):
+        with self._condition:
+            while (self._jobs or self._busy) and self._thread.is_alive():
+                self._condition.wait()
+
+    # Writes everything queued, then stops the thread
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._jobs and not self._stopped:
+                    self._condition.wait()
+                if not self._jobs:
+                    return
+                jobs = list(self._jobs)
+                self._jobs.clear()
+                self._busy = True
+            try:
+                # Writes may be reordered between closes and calls, which must follow the writes before them
+                run = []
+                for job in jobs:
+                    if job[2] is None:
+                        self._write(run)
+                        run = []
+                        fd, _, _, done = job
+                        if fd is None:
+                            done()
+                        else:
+                            error = self._close(fd)
+                            if done is not None:
+                                done(error)
+                    else:
+                        run.append(job)
+                self._write(run)
+            finally:
+                with self._condition:
+                    self._busy = False
+                    self._condition.notify_all()
+
+    # Closes a file, forcing it to disk first unless fsync is none; gets the OSError that failed it, or None
+    def _close(self, fd):
+        error = None
+        try:
+            if self.fsync != "none":
+                os.fsync(fd)
+        except OSError as exc:
+            error = exc
+        try:
+            os.close(fd)
+        except OSError as exc:
+            error = error or exc
+        if error is not None:
+            self.errors += 1
+        return error
+
+    # Writes a run of jobs, coalescing contiguous data of the same file
+    def _write(self, run):
+        run.sort(key = lambda job: (job[0], job[1]))
+        i = 0
+        while i < len(run):
+            fd, offset, data, _ = run[i]
+            end = offset + len(data)
+            j = i + 1
+            while j < len(run) and j - i < MAX_BUFFERS and run[j][0] == fd and run[j][1] == end:
+                end += len(run[j][2])
+                j += 1
+            buffers = [job[2] for job in run[i:j]]
+            error = None
+            try:
+                written = os.pwritev(fd, buffers, offset)
+                if written < end - offset:
+                    os.pwrite(fd, b"".join(buffers)[written:], offset + written)
+                if self.fsync == "always":
+                    os.fsync(fd)
+            except OSError as exc:
+                error = exc
+                self.errors += 1
+            else:
+                self.writes += 1
+                self.written += end - offset
+            with self._condition:
+                self.queued -= end - offset
+            for job_fd, job_offset, job_data, done in run[i:j]:
+                if done is not None:
+                    done(job_offset, job_data, error)
+            i = j